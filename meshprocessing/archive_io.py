@@ -0,0 +1,207 @@
+# archive_io.py
+
+"""
+Streaming input/output layer for cohorts delivered as zip or tar archives.
+
+Segmentations are read member by member straight from the archive, without extracting
+the bundle to disk. Members are read sequentially (so compressed tar streams are read
+in a single pass), while gzip decompression and NIfTI parsing run in worker threads
+with a bounded read-ahead, so at most `read_ahead` images are held in memory at once.
+
+Outputs are written either to a directory (mirroring the member paths) or into an
+output .zip / .tar(.gz) archive. Member names are checked so that nothing is written outside
+the output (no absolute paths or ".." components). Existing .zip and uncompressed .tar outputs
+are appended to, so an interrupted run can be resumed; compressed tars cannot be appended to
+and are never overwritten.
+
+Dependencies:
+- nibabel
+- vtk
+"""
+
+import gzip
+import io
+import ntpath
+import os
+import posixpath
+import tarfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def is_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def safe_member_name(name):
+    """Normalized relative member path; absolute paths and ".." components are rejected (zip-slip)."""
+    parts = name.replace("\\", "/").split("/")
+    if ntpath.splitdrive(name)[0] or name.startswith(("/", "\\")) or ".." in parts:
+        raise ValueError(f"Unsafe archive member name: {name}")
+    normalized = posixpath.normpath("/".join(parts))
+    if normalized in (".", ""):
+        raise ValueError(f"Unsafe archive member name: {name}")
+    return normalized
+
+
+def _is_safe(name):
+    try:
+        safe_member_name(name)
+        return True
+    except ValueError:
+        print(f"Skipping archive member with unsafe path: {name}")
+        return False
+
+
+def iter_archive_members(archive_path, suffix=".nii.gz", skip=None):
+    """
+    Yield (member_name, raw_bytes) for every archive member ending with suffix, in archive order.
+    Members with absolute paths or ".." components are skipped, as are members for which
+    skip(member_name) is true (e.g. already processed ones); these are never read.
+    """
+    if archive_path.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.endswith(suffix) and _is_safe(info.filename) and \
+                        not (skip and skip(info.filename)):
+                    yield info.filename, archive.read(info)
+    else:
+        # Stream mode reads compressed tars front to back without seeking
+        with tarfile.open(archive_path, mode="r|*") as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith(suffix) and _is_safe(member.name) and \
+                        not (skip and skip(member.name)):
+                    yield member.name, archive.extractfile(member).read()
+
+
+def decompress_nifti(raw_bytes):
+    """Uncompressed NIfTI bytes from .nii or .nii.gz member contents."""
+    if raw_bytes[:2] == b"\x1f\x8b":
+        return gzip.decompress(raw_bytes)
+    return raw_bytes
+
+
+def load_nifti_bytes(raw_bytes):
+    """Parse .nii or .nii.gz member contents into a nibabel image."""
+    import nibabel as nib
+
+    return nib.Nifti1Image.from_bytes(decompress_nifti(raw_bytes))
+
+
+def iter_decoded_members(archive_path, decode, suffix=".nii.gz", read_ahead=4, n_threads=None, skip=None):
+    """
+    Yield (member_name, decode(raw_bytes)) in archive order.
+
+    Decoding runs in a thread pool while the next members are being read; no more than
+    read_ahead members are in flight at any time. Members for which skip(member_name) is
+    true are neither read nor decoded.
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=n_threads or min(read_ahead, os.cpu_count() or 1)) as pool:
+        for name, raw_bytes in iter_archive_members(archive_path, suffix, skip):
+            pending.append((name, pool.submit(decode, raw_bytes)))
+            if len(pending) >= read_ahead:
+                done_name, future = pending.popleft()
+                yield done_name, future.result()
+        while pending:
+            done_name, future = pending.popleft()
+            yield done_name, future.result()
+
+
+def iter_nifti_images(archive_path, suffix=".nii.gz", read_ahead=4, n_threads=None, skip=None):
+    """Yield (member_name, nibabel image) for every NIfTI member, decompressed in memory."""
+    return iter_decoded_members(archive_path, load_nifti_bytes, suffix, read_ahead, n_threads, skip)
+
+
+def iter_nifti_bytes(archive_path, suffix=".nii.gz", read_ahead=4, n_threads=None, skip=None):
+    """Yield (member_name, uncompressed NIfTI bytes), e.g. for tools that need a file on disk."""
+    return iter_decoded_members(archive_path, decompress_nifti, suffix, read_ahead, n_threads, skip)
+
+
+def nifti_to_bytes(image, name):
+    """Serialize a nibabel image, gzip-compressed if name ends with .gz."""
+    data = image.to_bytes()
+    return gzip.compress(data, compresslevel=6) if name.endswith(".gz") else data
+
+
+def polydata_to_bytes(mesh):
+    """Serialize a vtkPolyData as a binary legacy .vtk file."""
+    import vtk
+
+    writer = vtk.vtkPolyDataWriter()
+    writer.SetInputData(mesh)
+    writer.SetFileTypeToBinary()
+    writer.WriteToOutputStringOn()
+    writer.Write()
+    data = writer.GetOutputStdString()
+    # VTK returns the payload as str when it happens to be valid UTF-8, decoded as UTF-8
+    return data if isinstance(data, bytes) else data.encode("utf-8")
+
+
+class OutputSink:
+    """
+    Write named outputs to a directory or into a .zip / .tar(.gz) archive.
+
+    Use as a context manager; member names may contain sub-directories. Existing .zip / .tar
+    outputs are appended to, and their members count as already written.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.archive = None
+        self.names = set()
+
+        lower = output.lower()
+        if lower.endswith(".zip"):
+            if os.path.exists(output):
+                self.archive = zipfile.ZipFile(output, mode="a", compression=zipfile.ZIP_DEFLATED)
+                self.names = set(self.archive.namelist())
+            else:
+                self.archive = zipfile.ZipFile(output, mode="w", compression=zipfile.ZIP_DEFLATED)
+        elif lower.endswith(ARCHIVE_EXTENSIONS):
+            if lower.endswith(".tar"):
+                self.archive = tarfile.open(output, mode="a")
+                self.names = set(self.archive.getnames())
+            elif os.path.exists(output):
+                raise FileExistsError(f"{output} exists and compressed tar archives cannot be appended to; "
+                                      "remove it or write to a directory, .zip or .tar output")
+            else:
+                mode = "w:gz" if lower.endswith((".tar.gz", ".tgz")) else "w:bz2" if lower.endswith(".bz2") else "w:xz"
+                self.archive = tarfile.open(output, mode=mode)
+        else:
+            os.makedirs(output, exist_ok=True)
+
+    def exists(self, name):
+        name = safe_member_name(name)
+        if self.archive is not None:
+            return name in self.names
+        return os.path.exists(os.path.join(self.output, name))
+
+    def write(self, name, data):
+        name = safe_member_name(name)
+        self.names.add(name)
+        if isinstance(self.archive, zipfile.ZipFile):
+            self.archive.writestr(name, data)
+        elif self.archive is not None:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            self.archive.addfile(info, io.BytesIO(data))
+        else:
+            path = os.path.join(self.output, name)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+        return os.path.join(self.output, name)
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -7,6 +7,13 @@ transformation matrices are saved in a single CSV file.
 
 If a pre-established or idealized reference template is not provided, please refer to medoid_search.py to find a suitable template.
 
+With multires_levels, ICP runs coarse-to-fine on a pyramid of each mesh: decimated surfaces
+for the template (built once for the whole cohort) and vertex subsets for the moving meshes,
+since ICP only uses their points. Each level matches all of its points (instead of VTK's default
+of 200 landmarks), most iterations are spent on the coarse levels and only a few refinement
+iterations run at full resolution. Per-level timings are added to
+the transformation CSV.
+
 Dependencies:
 - vtk
 - numpy
@@ -14,10 +21,11 @@ Dependencies:
 """
 
 import os
+import time
 import numpy as np
 import vtk
 import csv
-from vtk.util.numpy_support import vtk_to_numpy
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
 
 
 def read_vtk_file(file_path):
@@ -27,13 +35,18 @@ def read_vtk_file(file_path):
     return reader.GetOutput()
 
 
-def get_icp_transform(source, target, max_iter=100):
+def get_icp_transform(source, target, max_iter=100, match_centroids=True, max_landmarks=None):
+    """max_landmarks: source points matched per iteration (VTK default 200, "all" for every point)."""
     icp = vtk.vtkIterativeClosestPointTransform()
     icp.SetSource(source)
     icp.SetTarget(target)
     icp.GetLandmarkTransform().SetModeToRigidBody()
     icp.SetMaximumNumberOfIterations(max_iter)
-    icp.StartByMatchingCentroidsOn()
+    if max_landmarks == "all":
+        max_landmarks = source.GetNumberOfPoints()
+    if max_landmarks is not None:
+        icp.SetMaximumNumberOfLandmarks(max_landmarks)
+    icp.SetStartByMatchingCentroids(match_centroids)
     icp.Modified()
     icp.Update()
     return icp
@@ -43,33 +56,150 @@ def matrix_to_flat_list(vtk_matrix):
     return [vtk_matrix.GetElement(i, j) for i in range(4) for j in range(4)]
 
 
-def align_meshes_to_template(mesh_paths, reference_path, transform_log_csv="icp_transforms.csv"):
+def matrix_to_numpy(vtk_matrix):
+    return np.array(matrix_to_flat_list(vtk_matrix)).reshape(4, 4)
+
+
+def transform_polydata(mesh, matrix):
+    transform = vtk.vtkTransform()
+    transform.SetMatrix(np.asarray(matrix).flatten())
+    transform_filter = vtk.vtkTransformPolyDataFilter()
+    transform_filter.SetInputData(mesh)
+    transform_filter.SetTransform(transform)
+    transform_filter.Update()
+    return transform_filter.GetOutput()
+
+
+def decimate_mesh(mesh, fraction):
+    """Quadric decimation keeping roughly the given fraction of the triangles."""
+    if fraction >= 1.0:
+        return mesh
+    triangles = vtk.vtkTriangleFilter()
+    triangles.SetInputData(mesh)
+
+    decimate = vtk.vtkQuadricDecimation()
+    decimate.SetInputConnection(triangles.GetOutputPort())
+    decimate.SetTargetReduction(1.0 - fraction)
+    decimate.Update()
+    return decimate.GetOutput()
+
+
+def subsample_points(mesh, fraction, seed=0):
+    """Random subset of the mesh vertices (as a point-only vtkPolyData)."""
+    if fraction >= 1.0:
+        return mesh
+    points = vtk_to_numpy(mesh.GetPoints().GetData())
+    n_points = max(3, int(round(fraction * len(points))))
+    subset = np.random.default_rng(seed).choice(len(points), n_points, replace=False)
+
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_to_vtk(np.ascontiguousarray(points[subset]), deep=True))
+    subsampled = vtk.vtkPolyData()
+    subsampled.SetPoints(vtk_points)
+    return subsampled
+
+
+def build_pyramid(mesh, levels, surface=True):
+    """
+    Coarse-to-fine copies of a mesh, one per level (fractions of the full resolution):
+    decimated surfaces, or vertex subsets with surface=False.
+    """
+    if not surface:
+        return [subsample_points(mesh, fraction) for fraction in levels]
+
+    # Decimate each level from the next finer one
+    pyramid = [mesh]
+    finer_fraction = 1.0
+    for fraction in sorted(levels, reverse=True):
+        if fraction < 1.0:
+            pyramid.append(decimate_mesh(pyramid[-1], fraction / finer_fraction))
+            finer_fraction = fraction
+    pyramid = pyramid[::-1]
+    return pyramid if 1.0 in levels else pyramid[:-1]
+
+
+def get_multires_icp_transform(source_pyramid, target_pyramid, iterations):
+    """
+    Chain ICP from the coarsest to the finest pyramid level, each level starting from the
+    transform of the previous one. Every level matches all of its source points, so the
+    number of landmarks grows with the level. Returns (4x4 matrix, seconds per level).
+    """
+    matrix = np.eye(4)
+    timings = []
+    for level, (source, target, max_iter) in enumerate(zip(source_pyramid, target_pyramid, iterations)):
+        start = time.perf_counter()
+        icp = get_icp_transform(transform_polydata(source, matrix), target, max_iter,
+                                match_centroids=level == 0, max_landmarks="all")
+        matrix = matrix_to_numpy(icp.GetMatrix()) @ matrix
+        timings.append(time.perf_counter() - start)
+    return matrix, timings
+
+
+def transform_difference(matrix_a, matrix_b, points):
+    """Rotation angle (degrees) and maximum point displacement between two rigid transforms applied to points."""
+    relative = matrix_a[:3, :3] @ matrix_b[:3, :3].T
+    angle = np.degrees(np.arccos(np.clip((np.trace(relative) - 1.0) / 2.0, -1.0, 1.0)))
+    displacement = points @ (matrix_a[:3, :3] - matrix_b[:3, :3]).T + (matrix_a[:3, 3] - matrix_b[:3, 3])
+    return angle, np.linalg.norm(displacement, axis=1).max()
+
+
+def align_meshes_to_template(mesh_paths, reference_path, transform_log_csv="icp_transforms.csv",
+                             multires_levels=None, multires_iterations=None, validate=False, tolerance=1.0,
+                             validate_iterations=300, max_landmarks=None):
+    """
+    multires_levels: e.g. (0.02, 0.1, 1.0) — mesh fractions from coarse to fine, None for
+    single-level ICP. multires_iterations: ICP iterations per level (default 200 at the
+    coarsest level, 100 at intermediate levels and 20 at full resolution); every level matches
+    all of its points. With validate=True, each multi-resolution transform is compared to
+    full-resolution ICP on all points with validate_iterations iterations (rotation angle and
+    maximum point displacement), with a warning when the displacement exceeds tolerance
+    (mesh units). max_landmarks: points matched by single-level ICP (VTK default 200, "all").
+    """
     print(f"\nAligning {len(mesh_paths)} meshes to template: {reference_path}")
     reference_mesh = read_vtk_file(reference_path)
 
+    if multires_levels:
+        if not multires_iterations:
+            n_levels = len(multires_levels)
+            multires_iterations = [200] + [100] * (n_levels - 2) + [20] if n_levels > 1 else [100]
+        reference_pyramid = build_pyramid(reference_mesh, multires_levels)
+        print("Template pyramid: " + ", ".join(str(m.GetNumberOfPoints()) for m in reference_pyramid) + " points")
+
     with open(transform_log_csv, mode="w", newline="") as csvfile:
         writer = csv.writer(csvfile)
         header = ["mesh_file"] + [f"m{i}{j}" for i in range(4) for j in range(4)]
+        if multires_levels:
+            header += [f"level{level}_seconds" for level in range(len(multires_levels))]
+            if validate:
+                header += ["angle_vs_full_deg", "displacement_vs_full"]
         writer.writerow(header)
 
         for mesh_path in mesh_paths:
             mesh = read_vtk_file(mesh_path)
-            transform = get_icp_transform(mesh, reference_mesh)
-
-            transform_filter = vtk.vtkTransformPolyDataFilter()
-            transform_filter.SetInputData(mesh)
-            transform_filter.SetTransform(transform)
-            transform_filter.Update()
+            extra_columns = []
+            if multires_levels:
+                matrix, timings = get_multires_icp_transform(
+                    build_pyramid(mesh, multires_levels, surface=False), reference_pyramid, multires_iterations)
+                extra_columns = timings
+                if validate:
+                    full = matrix_to_numpy(get_icp_transform(mesh, reference_mesh, validate_iterations,
+                                                             max_landmarks="all").GetMatrix())
+                    points = vtk_to_numpy(mesh.GetPoints().GetData()).astype(float)
+                    angle, displacement = transform_difference(matrix, full, points)
+                    extra_columns += [angle, displacement]
+                    if displacement > tolerance:
+                        print(f"Warning: {os.path.basename(mesh_path)} differs from full-resolution ICP "
+                              f"by {displacement:.3f} (rotation {angle:.2f} deg)")
+            else:
+                matrix = matrix_to_numpy(get_icp_transform(mesh, reference_mesh, max_landmarks=max_landmarks).GetMatrix())
 
             writer_vtk = vtk.vtkPolyDataWriter()
             writer_vtk.SetFileName(mesh_path)
-            writer_vtk.SetInputData(transform_filter.GetOutput())
+            writer_vtk.SetInputData(transform_polydata(mesh, matrix))
             writer_vtk.Write()
             print(f"Aligned and saved: {os.path.basename(mesh_path)}")
 
-            matrix = transform.GetMatrix()
-            matrix_flat = matrix_to_flat_list(matrix)
-            writer.writerow([os.path.basename(mesh_path)] + matrix_flat)
+            writer.writerow([os.path.basename(mesh_path)] + list(matrix.flatten()) + extra_columns)
 
     print(f"\nAll ICP transformations saved to: {transform_log_csv}")
 
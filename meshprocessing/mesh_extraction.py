@@ -4,25 +4,27 @@
 Pipeline for extracting, modifying, smoothing, and remeshing cardiac surface meshes from
 segmentation label maps. Applies dilation to the RV blood pool to create an epicardial shell,
 extracts a surface mesh using 3D Slicer's Python API, and remeshes it using pyacvd.
+Segmentations can be read from a directory tree or directly from a zip/tar archive (see archive_io.py).
 
 Dependencies:
 - 3D Slicer (with slicer module available in Python)
 - nibabel
 - numpy, scipy
 - pyvista, pyacvd
+
+Slicer, nibabel, scipy, pyvista and pyacvd are imported inside the functions that
+need them, so importing this module stays cheap and works outside of 3D Slicer.
 """
 
 import os
 import numpy as np
-import nibabel as nib
 import vtk
-import pyvista as pv
-import pyacvd
-import slicer
-from scipy.ndimage import binary_dilation
+from archive_io import OutputSink, iter_decoded_members, load_nifti_bytes, nifti_to_bytes, polydata_to_bytes
 
 
 def create_rv_epicardium(segmentation_data, dilation_radius_mm, voxel_spacing, padding_value=5):
+    from scipy.ndimage import binary_dilation
+
     dilation_radius_voxels = [int(dilation_radius_mm / vs) for vs in voxel_spacing]
     padded_seg = np.pad(segmentation_data, padding_value, mode='constant', constant_values=0)
     rv_mask = (padded_seg == 3)
@@ -43,7 +45,19 @@ def create_rv_epicardium(segmentation_data, dilation_radius_mm, voxel_spacing, p
     return epicardial_surface[tuple(bbox)]
 
 
+def epicardial_shell_image(img, dilation_radius_mm=3, padding_value=10):
+    import nibabel as nib
+
+    data = img.get_fdata()
+    spacing = img.header.get_zooms()
+
+    mod_data = create_rv_epicardium(data, dilation_radius_mm, spacing, padding_value)
+    return nib.Nifti1Image(mod_data, affine=img.affine, header=img.header)
+
+
 def process_segmentations(input_dir, input_suffix=".nii.gz", output_suffix="_with_epi_shell.nii.gz", dilation_radius_mm=3, padding_value=10):
+    import nibabel as nib
+
     print("\nSearching for segmentation files...")
     seg_files = [
         os.path.join(root, f)
@@ -54,18 +68,34 @@ def process_segmentations(input_dir, input_suffix=".nii.gz", output_suffix="_wit
 
     for seg_file in seg_files:
         print(f"Processing: {seg_file}")
-        img = nib.load(seg_file)
-        data = img.get_fdata()
-        spacing = img.header.get_zooms()
-
-        mod_data = create_rv_epicardium(data, dilation_radius_mm, spacing, padding_value)
-        out_img = nib.Nifti1Image(mod_data, affine=img.affine, header=img.header)
+        out_img = epicardial_shell_image(nib.load(seg_file), dilation_radius_mm, padding_value)
 
         out_path = seg_file.replace(input_suffix, output_suffix)
         nib.save(out_img, out_path)
         print(f"Saved: {out_path}")
 
 
+def extract_smoothed_surface(seg_file, label_name="Segment_2", n_iter=100):
+    """Closed surface of one segment of a label map, smoothed with a windowed sinc filter."""
+    import slicer
+
+    seg_node = slicer.util.loadSegmentation(seg_file)
+    seg_node.CreateClosedSurfaceRepresentation()
+
+    mesh = seg_node.GetClosedSurfaceInternalRepresentation(label_name)
+    smoother = vtk.vtkWindowedSincPolyDataFilter()
+    smoother.SetInputData(mesh)
+    smoother.SetNumberOfIterations(n_iter)
+    smoother.SetPassBand(0.1)
+    smoother.SetNormalizeCoordinates(False)
+    smoother.Update()
+
+    smoothed = vtk.vtkPolyData()
+    smoothed.DeepCopy(smoother.GetOutput())
+    slicer.mrmlScene.Clear(0)
+    return smoothed
+
+
 def extract_and_smooth_mesh(input_dir, label_name="Segment_2", input_suffix="_with_epi_shell.nii.gz", output_suffix="_mesh.vtk", n_iter=100):
     print("\nExtracting and smoothing surface meshes...")
     for root, _, files in os.walk(input_dir):
@@ -79,42 +109,92 @@ def extract_and_smooth_mesh(input_dir, label_name="Segment_2", input_suffix="_wi
                     continue
 
                 print(f"Creating mesh from: {seg_file}")
-                seg_node = slicer.util.loadSegmentation(seg_file)
-                seg_node.CreateClosedSurfaceRepresentation()
-
-                mesh = seg_node.GetClosedSurfaceInternalRepresentation(label_name)
-                smoother = vtk.vtkWindowedSincPolyDataFilter()
-                smoother.SetInputData(mesh)
-                smoother.SetNumberOfIterations(n_iter)
-                smoother.SetPassBand(0.1)
-                smoother.SetNormalizeCoordinates(False)
-                smoother.Update()
-
                 writer = vtk.vtkPolyDataWriter()
                 writer.SetFileName(out_file)
-                writer.SetInputData(smoother.GetOutput())
+                writer.SetInputData(extract_smoothed_surface(seg_file, label_name, n_iter))
                 writer.Write()
-
-                slicer.mrmlScene.Clear(0)
                 print(f"Saved mesh: {out_file}")
 
 
+def remesh_polydata(mesh, target_node_count=10000):
+    import pyvista as pv
+    import pyacvd
+
+    clus = pyacvd.Clustering(pv.wrap(mesh))
+    clus.subdivide(2)
+    clus.cluster(target_node_count)
+    return clus.create_mesh()
+
+
 def remesh_with_pyacvd(input_dir, target_node_count=10000, mesh_suffix="_mesh.vtk"):
+    import pyvista as pv
+
     print("\nRemeshing meshes to uniform vertex count...")
     for root, _, files in os.walk(input_dir):
         for file in files:
             if file.endswith(mesh_suffix):
                 file_path = os.path.join(root, file)
                 print(f"Remeshing: {file_path}")
-                mesh = pv.read(file_path)
-                clus = pyacvd.Clustering(mesh)
-                clus.subdivide(2)
-                clus.cluster(target_node_count)
-                remeshed = clus.create_mesh()
+                remeshed = remesh_polydata(pv.read(file_path), target_node_count)
                 remeshed.save(file_path)
                 print(f"Saved remeshed mesh: {file_path}")
 
 
+def process_segmentations_from_archive(archive_path, output, input_suffix=".nii.gz", output_suffix="_with_epi_shell.nii.gz", dilation_radius_mm=3, padding_value=10, read_ahead=4):
+    """Create the epicardial shell label maps straight from a zip/tar archive of segmentations."""
+    def decode(raw_bytes):
+        return epicardial_shell_image(load_nifti_bytes(raw_bytes), dilation_radius_mm, padding_value)
+
+    print(f"\nProcessing segmentations from archive: {archive_path}")
+    with OutputSink(output) as sink:
+        for name, out_img in iter_decoded_members(archive_path, decode, input_suffix, read_ahead):
+            out_name = name.replace(input_suffix, output_suffix)
+            sink.write(out_name, nifti_to_bytes(out_img, out_name))
+            print(f"Saved: {out_name}")
+
+
+def extract_biventricular_from_archive(archive_path, output, label_name="Segment_2", input_suffix=".nii.gz", shell_suffix="_with_epi_shell.nii.gz", output_suffix="_mesh.vtk",
+                                       dilation_radius_mm=3, padding_value=10, n_iter=100, target_node_count=10000, save_shell=True, read_ahead=4):
+    """
+    Full extraction pipeline (epicardial shell, surface extraction, smoothing, remeshing)
+    run member by member from a zip/tar archive of segmentations.
+
+    Shell creation runs in background threads with bounded read-ahead. Slicer needs a file
+    to load, so only the current label map is written to a temporary file.
+    """
+    import tempfile
+    import nibabel as nib
+
+    def decode(raw_bytes):
+        return epicardial_shell_image(load_nifti_bytes(raw_bytes), dilation_radius_mm, padding_value)
+
+    print(f"\nExtracting meshes from archive: {archive_path}")
+    with OutputSink(output) as sink, tempfile.TemporaryDirectory() as tmp_dir:
+        def done(name):
+            # Checked before the member is read, so resuming skips the shell creation too
+            mesh_name = name.replace(input_suffix, output_suffix)
+            if sink.exists(mesh_name):
+                print(f"Skipping {mesh_name}, already exists.")
+                return True
+            return False
+
+        for name, shell_img in iter_decoded_members(archive_path, decode, input_suffix, read_ahead, skip=done):
+            mesh_name = name.replace(input_suffix, output_suffix)
+            if save_shell:
+                shell_name = name.replace(input_suffix, shell_suffix)
+                sink.write(shell_name, nifti_to_bytes(shell_img, shell_name))
+
+            seg_file = os.path.join(tmp_dir, os.path.basename(name).replace(input_suffix, ".nii"))
+            nib.save(shell_img, seg_file)
+            mesh = extract_smoothed_surface(seg_file, label_name, n_iter)
+            os.remove(seg_file)
+
+            if target_node_count:
+                mesh = remesh_polydata(mesh, target_node_count)
+            sink.write(mesh_name, polydata_to_bytes(mesh))
+            print(f"Saved mesh: {mesh_name}")
+
+
 if __name__ == "__main__":
     input_root = "/path/to/healthy_population"  # <-- change this
 
@@ -2,20 +2,50 @@
 
 """
 Pipeline for extracting, smoothing, and remeshing anatomical surface meshes
-from a specific label in segmentation maps. 
+from a specific label in segmentation maps. Segmentations can be read from a directory
+tree or directly from a zip/tar archive (see archive_io.py).
+
+Several labels (e.g. LV endocardium, RV endocardium, epicardial shell) can be extracted
+from a single load of each label map with extract_and_smooth_labels, optionally with
+shared vertices at label interfaces (vtkSurfaceNets3D, VTK >= 9.3).
 
 Dependencies:
 - 3D Slicer (with slicer module available in Python)
 - nibabel
 - numpy
 - pyvista, pyacvd
+
+Slicer, pyvista and pyacvd are imported inside the functions that need them, so
+importing this module stays cheap and works outside of 3D Slicer.
 """
 
 import os
-import slicer
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import vtk
-import pyvista as pv
-import pyacvd
+from vtk.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+from archive_io import OutputSink, iter_nifti_bytes, polydata_to_bytes
+
+
+def extract_smoothed_surface(seg_file, label_name="Segment_1", n_iter=100):
+    """Closed surface of one segment of a label map, smoothed with a windowed sinc filter."""
+    import slicer
+
+    seg_node = slicer.util.loadSegmentation(seg_file)
+    seg_node.CreateClosedSurfaceRepresentation()
+
+    mesh = seg_node.GetClosedSurfaceInternalRepresentation(label_name)
+    smoother = vtk.vtkWindowedSincPolyDataFilter()
+    smoother.SetInputData(mesh)
+    smoother.SetNumberOfIterations(n_iter)
+    smoother.SetPassBand(0.1)
+    smoother.SetNormalizeCoordinates(False)
+    smoother.Update()
+
+    smoothed = vtk.vtkPolyData()
+    smoothed.DeepCopy(smoother.GetOutput())
+    slicer.mrmlScene.Clear(0)
+    return smoothed
 
 
 def extract_and_smooth_label(input_dir, label_name="Segment_1", input_suffix=".nii.gz", output_suffix="_mesh.vtk", n_iter=100):
@@ -31,44 +61,251 @@ def extract_and_smooth_label(input_dir, label_name="Segment_1", input_suffix=".n
                     continue
 
                 print(f"Creating mesh from: {seg_file}")
-                seg_node = slicer.util.loadSegmentation(seg_file)
-                seg_node.CreateClosedSurfaceRepresentation()
-
-                mesh = seg_node.GetClosedSurfaceInternalRepresentation(label_name)
-                smoother = vtk.vtkWindowedSincPolyDataFilter()
-                smoother.SetInputData(mesh)
-                smoother.SetNumberOfIterations(n_iter)
-                smoother.SetPassBand(0.1)
-                smoother.SetNormalizeCoordinates(False)
-                smoother.Update()
-
                 writer = vtk.vtkPolyDataWriter()
                 writer.SetFileName(out_file)
-                writer.SetInputData(smoother.GetOutput())
+                writer.SetInputData(extract_smoothed_surface(seg_file, label_name, n_iter))
                 writer.Write()
-
-                slicer.mrmlScene.Clear(0)
                 print(f"Saved mesh: {out_file}")
 
 
+def remesh_polydata(mesh, target_node_count=10000):
+    import pyvista as pv
+    import pyacvd
+
+    clus = pyacvd.Clustering(pv.wrap(mesh))
+    clus.subdivide(2)
+    clus.cluster(target_node_count)
+    return clus.create_mesh()
+
+
 def remesh_with_pyacvd(input_dir, target_node_count=10000, mesh_suffix="_mesh.vtk"):
+    import pyvista as pv
+
     print("\nRemeshing meshes to uniform vertex count...")
     for root, _, files in os.walk(input_dir):
         for file in files:
             if file.endswith(mesh_suffix):
                 file_path = os.path.join(root, file)
                 print(f"Remeshing: {file_path}")
-                mesh = pv.read(file_path)
-                clus = pyacvd.Clustering(mesh)
-                clus.subdivide(2)
-                clus.cluster(target_node_count)
-                remeshed = clus.create_mesh()
+                remeshed = remesh_polydata(pv.read(file_path), target_node_count)
                 remeshed.save(file_path)
                 print(f"Saved remeshed mesh: {file_path}")
 
 
+def extract_and_smooth_label_from_archive(archive_path, output, label_name="Segment_1", input_suffix=".nii.gz", output_suffix="_mesh.vtk", n_iter=100,
+                                          target_node_count=10000, read_ahead=4):
+    """
+    Extract, smooth and (optionally) remesh a single label for every segmentation in a
+    zip/tar archive, writing meshes to a directory or an output archive.
+
+    Segmentations are decompressed in memory in background threads with bounded read-ahead;
+    only the current label map is written to a temporary file for Slicer to load.
+    """
+    import tempfile
+
+    print(f"\nExtracting meshes of {label_name} from archive: {archive_path}")
+    with OutputSink(output) as sink, tempfile.TemporaryDirectory() as tmp_dir:
+        def done(name):
+            # Checked before the member is read and decompressed
+            mesh_name = name.replace(input_suffix, output_suffix)
+            if sink.exists(mesh_name):
+                print(f"Skipping {mesh_name}, already exists.")
+                return True
+            return False
+
+        for name, nifti_bytes in iter_nifti_bytes(archive_path, input_suffix, read_ahead, skip=done):
+            mesh_name = name.replace(input_suffix, output_suffix)
+            seg_file = os.path.join(tmp_dir, os.path.basename(name).replace(input_suffix, ".nii"))
+            with open(seg_file, "wb") as f:
+                f.write(nifti_bytes)
+            mesh = extract_smoothed_surface(seg_file, label_name, n_iter)
+            os.remove(seg_file)
+
+            if target_node_count:
+                mesh = remesh_polydata(mesh, target_node_count)
+            sink.write(mesh_name, polydata_to_bytes(mesh))
+            print(f"Saved mesh: {mesh_name}")
+
+
+def _label_value(label_name):
+    """Label map value of a segment name such as "Segment_2" (or a plain integer)."""
+    return int(str(label_name).rsplit("_", 1)[-1])
+
+
+def _polydata_from_arrays(points, faces, cell_arrays=None):
+    polydata = vtk.vtkPolyData()
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_to_vtk(np.ascontiguousarray(points, dtype=float), deep=True))
+    polydata.SetPoints(vtk_points)
+
+    cells = vtk.vtkCellArray()
+    offsets = np.arange(0, 3 * len(faces) + 1, 3, dtype=np.int64)
+    cells.SetData(numpy_to_vtk(offsets, deep=True), numpy_to_vtk(faces.ravel().astype(np.int64), deep=True))
+    polydata.SetPolys(cells)
+
+    for name, values in (cell_arrays or {}).items():
+        array = numpy_to_vtk(np.ascontiguousarray(values), deep=True)
+        array.SetName(name)
+        polydata.GetCellData().AddArray(array)
+    return polydata
+
+
+def extract_smoothed_surfaces(seg_file, label_names=("Segment_1", "Segment_2", "Segment_3"), n_iter=100, pool=None):
+    """
+    Closed surfaces of several segments from a single load of the label map.
+
+    The closed-surface representation is built once for all segments, and the per-label
+    smoothing runs concurrently when a thread pool is given.
+    """
+    import slicer
+
+    seg_node = slicer.util.loadSegmentation(seg_file)
+    seg_node.CreateClosedSurfaceRepresentation()
+
+    surfaces = []
+    for label_name in label_names:
+        surface = vtk.vtkPolyData()
+        surface.DeepCopy(seg_node.GetClosedSurfaceInternalRepresentation(label_name))
+        surfaces.append(surface)
+    slicer.mrmlScene.Clear(0)
+
+    def smooth(mesh):
+        smoother = vtk.vtkWindowedSincPolyDataFilter()
+        smoother.SetInputData(mesh)
+        smoother.SetNumberOfIterations(n_iter)
+        smoother.SetPassBand(0.1)
+        smoother.SetNormalizeCoordinates(False)
+        smoother.Update()
+        return smoother.GetOutput()
+
+    smoothed = pool.map(smooth, surfaces) if pool is not None else map(smooth, surfaces)
+    return dict(zip(label_names, smoothed))
+
+
+def extract_surface_net_meshes(seg_file, label_names=("Segment_1", "Segment_2", "Segment_3"), n_iter=100):
+    """
+    Surfaces of several labels from one vtkSurfaceNets3D pass over the label map.
+
+    Neighbouring labels share the vertices on their interface. Returns the labelled mesh
+    (cell array "BoundaryLabels" holds the labels on both sides of each face) and a dict of
+    per-label closed surfaces, oriented outwards, in the world (RAS) coordinates of the image.
+    """
+    import nibabel as nib
+
+    img = nib.load(seg_file)
+    data = np.asarray(img.dataobj).astype(np.int32)
+
+    image = vtk.vtkImageData()
+    image.SetDimensions(data.shape)
+    image.GetPointData().SetScalars(numpy_to_vtk(data.ravel(order="F"), deep=True))
+
+    label_values = [_label_value(name) for name in label_names]
+    surface_nets = vtk.vtkSurfaceNets3D()
+    surface_nets.SetInputData(image)
+    for i, value in enumerate(label_values):
+        surface_nets.SetLabel(i, value)
+    surface_nets.SetOutputMeshTypeToTriangles()
+    surface_nets.SetNumberOfIterations(n_iter)
+    surface_nets.Update()
+    output = surface_nets.GetOutput()
+
+    # Voxel indices to world coordinates; a mirroring affine flips the face orientation
+    affine = img.affine
+    points = vtk_to_numpy(output.GetPoints().GetData()).astype(float) @ affine[:3, :3].T + affine[:3, 3]
+    faces = vtk_to_numpy(output.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+    boundary_labels = vtk_to_numpy(output.GetCellData().GetArray("BoundaryLabels"))
+    if np.linalg.det(affine[:3, :3]) < 0:
+        faces = faces[:, ::-1]
+
+    labelled_mesh = _polydata_from_arrays(points, faces, {"BoundaryLabels": boundary_labels})
+
+    meshes = {}
+    for label_name, value in zip(label_names, label_values):
+        # Faces are oriented from the first towards the second boundary label
+        selected = (boundary_labels[:, 0] == value) | (boundary_labels[:, 1] == value)
+        label_faces = faces[selected]
+        flip = boundary_labels[selected, 1] == value
+        label_faces[flip] = label_faces[flip][:, ::-1]
+
+        used, compact_faces = np.unique(label_faces, return_inverse=True)
+        meshes[label_name] = _polydata_from_arrays(points[used], compact_faces.reshape(-1, 3))
+    return labelled_mesh, meshes
+
+
+def merge_labelled_meshes(meshes):
+    """Append per-label meshes into one mesh with a "Label" cell array."""
+    append = vtk.vtkAppendPolyData()
+    for label_name, mesh in meshes.items():
+        labelled = vtk.vtkPolyData()
+        labelled.ShallowCopy(mesh)
+        labels = numpy_to_vtk(np.full(mesh.GetNumberOfCells(), _label_value(label_name), dtype=np.int32), deep=True)
+        labels.SetName("Label")
+        labelled.GetCellData().AddArray(labels)
+        append.AddInputData(labelled)
+    append.Update()
+    return append.GetOutput()
+
+
+def extract_label_meshes(seg_file, label_names=("Segment_1", "Segment_2", "Segment_3"), n_iter=100, target_node_count=None,
+                         merge=False, shared_interfaces=False, pool=None):
+    """
+    Extract, smooth and (optionally) remesh several labels from a single segmentation load.
+
+    Returns {output_key: mesh}, with one entry per label, or a single "labels" entry when merge=True.
+    With shared_interfaces=True the surfaces come from one surface-nets pass and share vertices
+    at label interfaces; the merged mesh then keeps those shared vertices and is not remeshed.
+    """
+    mapper = pool.map if pool is not None else map
+
+    if shared_interfaces:
+        labelled_mesh, meshes = extract_surface_net_meshes(seg_file, label_names, n_iter)
+        if merge:
+            return {"labels": labelled_mesh}
+    else:
+        meshes = extract_smoothed_surfaces(seg_file, label_names, n_iter, pool)
+
+    if target_node_count:
+        meshes = dict(zip(meshes, mapper(lambda mesh: remesh_polydata(mesh, target_node_count), meshes.values())))
+    if merge:
+        return {"labels": merge_labelled_meshes(meshes)}
+    return meshes
+
+
+def _label_output_name(name, key, input_suffix, output_suffix):
+    return name.replace(input_suffix, f"_{key}{output_suffix}")
+
+
+def extract_and_smooth_labels(input_dir, label_names=("Segment_1", "Segment_2", "Segment_3"), input_suffix=".nii.gz", output_suffix="_mesh.vtk", n_iter=100,
+                              target_node_count=None, merge=False, shared_interfaces=False, n_jobs=None):
+    """
+    Multi-label version of extract_and_smooth_label: every segmentation is loaded once and all
+    requested labels are extracted from it, smoothed and remeshed concurrently.
+
+    Writes <name>_<label>_mesh.vtk per label, or <name>_labels_mesh.vtk with merge=True.
+    """
+    print(f"\nExtracting and smoothing meshes for labels: {', '.join(label_names)}...")
+    with ThreadPoolExecutor(max_workers=n_jobs or len(label_names)) as pool, OutputSink(input_dir) as sink:
+        for root, _, files in os.walk(input_dir):
+            for file in files:
+                if not file.endswith(input_suffix):
+                    continue
+                seg_file = os.path.join(root, file)
+                name = os.path.relpath(seg_file, input_dir)
+                keys = ["labels"] if merge else list(label_names)
+                out_names = {key: _label_output_name(name, key, input_suffix, output_suffix) for key in keys}
+
+                if all(sink.exists(out_name) for out_name in out_names.values()):
+                    print(f"Skipping {seg_file}, meshes already exist.")
+                    continue
+
+                print(f"Creating meshes from: {seg_file}")
+                meshes = extract_label_meshes(seg_file, label_names, n_iter, target_node_count, merge, shared_interfaces, pool)
+                for key, mesh in meshes.items():
+                    print(f"Saved mesh: {sink.write(out_names[key], polydata_to_bytes(mesh))}")
+
+
 if __name__ == "__main__":
     input_root = "/path/to/segmentations"  # <-- change this to your designated folder
 
-    extract_and_smooth_single_label(input_root)
+    extract_and_smooth_label(input_root)
     remesh_with_pyacvd(input_root)
\ No newline at end of file
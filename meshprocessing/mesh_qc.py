@@ -0,0 +1,212 @@
+# mesh_qc.py
+
+"""
+Mesh quality control for a whole cohort, to catch bad extractions (holes, non-manifold
+edges, flipped normals, degenerate triangles, wrong vertex counts) before they reach
+ICP alignment or Deformetrica.
+
+All metrics are computed with vectorized NumPy over the triangle arrays; meshes are
+processed in parallel worker processes. The results are written to a metrics table and a
+pass/fail manifest (mesh_file, passed, reasons) that later stages can use to skip failures.
+
+Metrics per mesh:
+- number of points and triangles, unreferenced points, vertex count vs. target_node_count
+- enclosed (signed) volume and surface area — a negative volume means inward-facing normals
+- edge length and aspect ratio statistics, degenerate (zero-area) triangles
+- boundary edges (holes), non-manifold edges, edges with inconsistent triangle orientation
+- connected components
+
+Dependencies:
+- vtk
+- numpy
+- scipy
+- csv
+"""
+
+import os
+import csv
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import vtk
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from vtk.util.numpy_support import vtk_to_numpy
+
+DEFAULT_THRESHOLDS = {
+    "max_boundary_edges": 0,
+    "max_nonmanifold_edges": 0,
+    "max_inconsistent_edges": 0,
+    "max_components": 1,
+    "max_degenerate_triangles": 0,
+    "max_aspect_ratio": 20.0,
+    "node_count_tolerance": 0.05,  # relative deviation from target_node_count
+}
+
+
+def read_vtk_file(file_path):
+    reader = vtk.vtkPolyDataReader()
+    reader.SetFileName(file_path)
+    reader.Update()
+    return reader.GetOutput()
+
+
+def mesh_arrays(mesh):
+    """Points (n, 3) and triangles (m, 3) of a vtkPolyData surface."""
+    triangles = vtk.vtkTriangleFilter()
+    triangles.SetInputData(mesh)
+    triangles.Update()
+    surface = triangles.GetOutput()
+    if surface.GetNumberOfPoints() == 0 or surface.GetNumberOfPolys() == 0:
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64)
+
+    points = vtk_to_numpy(surface.GetPoints().GetData()).astype(float)
+    faces = vtk_to_numpy(surface.GetPolys().GetConnectivityArray()).reshape(-1, 3).astype(np.int64)
+    return points, faces
+
+
+def _edge_counts(edges, n_points):
+    """Occurrences of each (row) edge, using a scalar key per vertex pair."""
+    keys = edges[:, 0] * n_points + edges[:, 1]
+    _, counts = np.unique(keys, return_counts=True)
+    return counts
+
+
+def mesh_metrics(points, faces, target_node_count=None):
+    """Quality metrics of a triangle mesh given as point and face arrays."""
+    n_points, n_faces = len(points), len(faces)
+    metrics = {"n_points": n_points, "n_triangles": n_faces}
+    if n_faces == 0:
+        return metrics
+
+    a, b, c = points[faces[:, 0]], points[faces[:, 1]], points[faces[:, 2]]
+    cross = np.cross(b - a, c - a)
+    areas = 0.5 * np.linalg.norm(cross, axis=1)
+    lengths = np.stack([
+        np.linalg.norm(b - a, axis=1), np.linalg.norm(c - b, axis=1), np.linalg.norm(a - c, axis=1)
+    ], axis=1)
+
+    # Aspect ratio l_max * perimeter / (4 sqrt(3) area): 1 for equilateral triangles
+    degenerate = (areas <= 1e-12 * max(lengths.max(), 1.0) ** 2) | (faces[:, 0] == faces[:, 1]) | \
+        (faces[:, 1] == faces[:, 2]) | (faces[:, 0] == faces[:, 2])
+    aspect_ratio = lengths.max(axis=1) * lengths.sum(axis=1) / (4.0 * np.sqrt(3.0) * np.maximum(areas, 1e-300))
+    aspect_ratio = aspect_ratio[~degenerate]
+
+    # Undirected edges: seen once on a boundary, twice on a manifold surface, more otherwise
+    directed = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    undirected_counts = _edge_counts(np.sort(directed, axis=1), n_points)
+    # In a consistently oriented surface, each directed edge is traversed at most once
+    directed_counts = _edge_counts(directed, n_points)
+
+    used = np.unique(faces)
+    adjacency = coo_matrix((np.ones(len(directed)), (directed[:, 0], directed[:, 1])), shape=(n_points, n_points))
+    _, labels = connected_components(adjacency, directed=False)
+
+    metrics.update({
+        "unreferenced_points": n_points - len(used),
+        "volume": float(np.einsum("ij,ij->", a, np.cross(b, c)) / 6.0),
+        "area": float(areas.sum()),
+        "edge_length_min": float(lengths.min()),
+        "edge_length_mean": float(lengths.mean()),
+        "edge_length_max": float(lengths.max()),
+        "edge_length_std": float(lengths.std()),
+        "aspect_ratio_mean": float(aspect_ratio.mean()) if aspect_ratio.size else np.nan,
+        "aspect_ratio_max": float(aspect_ratio.max()) if aspect_ratio.size else np.nan,
+        "degenerate_triangles": int(degenerate.sum()),
+        "boundary_edges": int(np.sum(undirected_counts == 1)),
+        "nonmanifold_edges": int(np.sum(undirected_counts > 2)),
+        "inconsistent_edges": int(np.sum(directed_counts > 1)),
+        "components": len(np.unique(labels[used])),
+    })
+    if target_node_count:
+        metrics["node_count_deviation"] = (n_points - target_node_count) / target_node_count
+    return metrics
+
+
+def qc_failures(metrics, thresholds=None):
+    """Reasons why a mesh fails the QC thresholds (an empty list if it passes)."""
+    thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    if "error" in metrics:
+        return [f"unreadable ({metrics['error']})"]
+    if metrics["n_triangles"] == 0:
+        return ["empty mesh"]
+
+    reasons = []
+    for key, name in [("boundary_edges", "boundary edges"), ("nonmanifold_edges", "non-manifold edges"),
+                      ("inconsistent_edges", "inconsistently oriented edges"), ("components", "components"),
+                      ("degenerate_triangles", "degenerate triangles")]:
+        if metrics[key] > thresholds["max_" + key]:
+            reasons.append(f"{metrics[key]} {name}")
+    if metrics["volume"] <= 0:
+        reasons.append("inward-facing normals" if metrics["volume"] < 0 else "zero volume")
+    if metrics["aspect_ratio_max"] > thresholds["max_aspect_ratio"]:
+        reasons.append(f"aspect ratio {metrics['aspect_ratio_max']:.1f}")
+    deviation = metrics.get("node_count_deviation")
+    if deviation is not None and abs(deviation) > thresholds["node_count_tolerance"]:
+        reasons.append(f"{metrics['n_points']} points ({deviation:+.1%} vs. target)")
+    return reasons
+
+
+def mesh_file_metrics(file_path, target_node_count=None):
+    try:
+        points, faces = mesh_arrays(read_vtk_file(file_path))
+        metrics = mesh_metrics(points, faces, target_node_count)
+    except Exception as error:
+        metrics = {"error": str(error)}
+    return {"mesh_file": file_path, **metrics}
+
+
+def mesh_qc(mesh_paths, target_node_count=None, thresholds=None, metrics_csv="mesh_qc_metrics.csv",
+            manifest_csv="mesh_qc_manifest.csv", n_jobs=None):
+    """
+    Compute QC metrics for all meshes in parallel processes and write the metrics table and
+    the pass/fail manifest. Returns the list of per-mesh metrics (with passed / reasons).
+    """
+    print(f"\nRunning QC on {len(mesh_paths)} meshes...")
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        results = list(pool.map(mesh_file_metrics, mesh_paths, [target_node_count] * len(mesh_paths),
+                                chunksize=max(1, len(mesh_paths) // (4 * (n_jobs or os.cpu_count() or 1)))))
+
+    for result in results:
+        reasons = qc_failures(result, thresholds)
+        result["passed"] = not reasons
+        result["reasons"] = "; ".join(reasons)
+        if reasons:
+            print(f"FAILED {os.path.basename(result['mesh_file'])}: {result['reasons']}")
+
+    columns = list(dict.fromkeys(key for result in results for key in result))
+    with open(metrics_csv, mode="w", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(results)
+
+    with open(manifest_csv, mode="w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["mesh_file", "passed", "reasons"])
+        for result in results:
+            writer.writerow([result["mesh_file"], result["passed"], result["reasons"]])
+
+    n_passed = sum(result["passed"] for result in results)
+    print(f"{n_passed}/{len(results)} meshes passed QC. Metrics: {metrics_csv}, manifest: {manifest_csv}")
+    return results
+
+
+def filter_meshes(mesh_paths, manifest_csv):
+    """Keep the meshes that passed QC in the manifest (meshes missing from the manifest are dropped)."""
+    with open(manifest_csv, newline="") as csvfile:
+        passed = {os.path.abspath(row["mesh_file"]) for row in csv.DictReader(csvfile) if row["passed"] == "True"}
+    kept = [path for path in mesh_paths if os.path.abspath(path) in passed]
+    if len(kept) < len(mesh_paths):
+        print(f"Skipping {len(mesh_paths) - len(kept)} meshes that did not pass QC ({manifest_csv}).")
+    return kept
+
+
+if __name__ == "__main__":
+    import glob
+
+    input_dir = "/path/to/meshes"  # <-- Change this to the desired path
+    file_suffix = "_mesh.vtk"  # <-- Change this to expected suffix
+
+    mesh_files = sorted(glob.glob(os.path.join(input_dir, f"**/*{file_suffix}"), recursive=True))
+    print(f"Found {len(mesh_files)} mesh files.")
+
+    mesh_qc(mesh_files, target_node_count=10000)
@@ -0,0 +1,543 @@
+# pipeline.py
+
+"""
+Command-line entry point for the cardiac shape modeling pipeline.
+
+Each stage of the pipeline is a subcommand. Options can be given on the command line
+or in a JSON/TOML config file (--config), either as flat keys or in a section named
+after the subcommand; command-line values take precedence over the config file.
+
+    python pipeline.py ssm --input-dir meshes/ --output-dir model/ --plot variance.png
+    python pipeline.py deformetrica-xml --config deformetrica.toml
+    python pipeline.py stats --config stats.json --n-permutations 10000
+
+Only the standard library is imported at startup. The stage modules, and with them
+heavy dependencies such as vtk, pyvista, slicer or statsmodels, are imported inside
+the subcommand that needs them.
+
+Example config (TOML):
+
+    [ssm]
+    input_dir = "/path/to/reconstructed_vtk_meshes"
+    output_dir = "/path/to/model"
+    plot = "/path/to/variance_plot.png"
+"""
+
+import argparse
+import glob
+import importlib
+import json
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _import_stage(stage_dir, module_name):
+    """Import a stage script, with its directory first on the path for its sibling imports."""
+    path = os.path.join(REPO_ROOT, stage_dir)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    return importlib.import_module(module_name)
+
+
+def _find_meshes(input_dir, suffix):
+    mesh_files = sorted(glob.glob(os.path.join(input_dir, f"**/*{suffix}"), recursive=True))
+    print(f"Found {len(mesh_files)} mesh files.")
+    return mesh_files
+
+
+def _apply_qc_manifest(mesh_files, manifest):
+    if not manifest:
+        return mesh_files
+    return _import_stage("meshprocessing", "mesh_qc").filter_meshes(mesh_files, manifest)
+
+
+def _read_table(path):
+    import pandas as pd
+
+    if path.endswith((".xlsx", ".xls")):
+        return pd.read_excel(path)
+    return pd.read_csv(path)
+
+
+def _mode_columns(prefix, n_modes):
+    return [f"{prefix}{i}" for i in range(1, n_modes + 1)]
+
+
+def _parse_value(value):
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _load_config(path):
+    if path.endswith(".toml"):
+        import tomllib
+
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+# === Subcommands ===
+
+def _archive_output(args):
+    if not args.output:
+        raise SystemExit("--output (directory or .zip/.tar archive) is required when --input-dir is an archive")
+    return args.output
+
+
+def _is_archive(path):
+    # archive_io only imports the standard library at module level
+    return _import_stage("meshprocessing", "archive_io").is_archive(path)
+
+
+def cmd_extract_biventricular(args):
+    extraction = _import_stage("meshprocessing", "mesh_extraction")
+    if _is_archive(args.input_dir):
+        extraction.extract_biventricular_from_archive(
+            args.input_dir, _archive_output(args), label_name=args.label_name,
+            dilation_radius_mm=args.dilation_radius_mm, padding_value=args.padding, n_iter=args.n_iter,
+            target_node_count=args.target_node_count, read_ahead=args.read_ahead)
+        return
+
+    extraction.process_segmentations(args.input_dir, dilation_radius_mm=args.dilation_radius_mm,
+                                     padding_value=args.padding)
+    extraction.extract_and_smooth_mesh(args.input_dir, label_name=args.label_name, n_iter=args.n_iter)
+    extraction.remesh_with_pyacvd(args.input_dir, target_node_count=args.target_node_count)
+
+
+def cmd_extract_label(args):
+    extraction = _import_stage("meshprocessing", "mesh_extraction_single_label")
+    if _is_archive(args.input_dir):
+        extraction.extract_and_smooth_label_from_archive(
+            args.input_dir, _archive_output(args), label_name=args.label_name, input_suffix=args.input_suffix,
+            output_suffix=args.output_suffix, n_iter=args.n_iter, target_node_count=args.target_node_count,
+            read_ahead=args.read_ahead)
+        return
+
+    extraction.extract_and_smooth_label(args.input_dir, label_name=args.label_name, input_suffix=args.input_suffix,
+                                        output_suffix=args.output_suffix, n_iter=args.n_iter)
+    extraction.remesh_with_pyacvd(args.input_dir, target_node_count=args.target_node_count,
+                                  mesh_suffix=args.output_suffix)
+
+
+def cmd_extract_labels(args):
+    extraction = _import_stage("meshprocessing", "mesh_extraction_single_label")
+    extraction.extract_and_smooth_labels(args.input_dir, label_names=args.label_names, input_suffix=args.input_suffix,
+                                         output_suffix=args.output_suffix, n_iter=args.n_iter,
+                                         target_node_count=args.target_node_count, merge=args.merge,
+                                         shared_interfaces=args.shared_interfaces, n_jobs=args.n_jobs)
+
+
+def cmd_remesh(args):
+    extraction = _import_stage("meshprocessing", "mesh_extraction_single_label")
+    extraction.remesh_with_pyacvd(args.input_dir, target_node_count=args.target_node_count,
+                                  mesh_suffix=args.mesh_suffix)
+
+
+def cmd_qc(args):
+    qc = _import_stage("meshprocessing", "mesh_qc")
+    mesh_files = _find_meshes(args.input_dir, args.mesh_suffix)
+    thresholds = {"max_aspect_ratio": args.max_aspect_ratio, "node_count_tolerance": args.node_count_tolerance,
+                  "max_boundary_edges": args.max_boundary_edges, "max_components": args.max_components}
+    qc.mesh_qc(mesh_files, target_node_count=args.target_node_count, thresholds=thresholds,
+               metrics_csv=args.metrics_csv, manifest_csv=args.manifest, n_jobs=args.n_jobs)
+
+
+def cmd_medoid(args):
+    medoid_search = _import_stage("meshprocessing", "medoid_search")
+    mesh_files = _apply_qc_manifest(_find_meshes(args.input_dir, args.mesh_suffix), args.qc_manifest)
+    if not args.skip_pre_align:
+        medoid_search.pre_align_population(mesh_files)
+    medoid = medoid_search.find_medoid(mesh_files, log_path=args.log_path)
+    print("\nMedoid mesh:", medoid)
+
+
+def cmd_align(args):
+    alignment = _import_stage("meshprocessing", "mesh_ICP_alignment")
+    mesh_files = _apply_qc_manifest(_find_meshes(args.input_dir, args.mesh_suffix), args.qc_manifest)
+    alignment.align_meshes_to_template(mesh_files, args.reference, transform_log_csv=args.transform_log,
+                                       multires_levels=args.multires_levels,
+                                       multires_iterations=args.multires_iterations,
+                                       validate=args.validate, tolerance=args.tolerance)
+
+
+def cmd_select_cohort(args):
+    selection = _import_stage("shapemodeling/deformetrica", "optimization_cohort_selection")
+    mesh_files = _apply_qc_manifest(glob.glob(os.path.join(args.input_dir, args.file_pattern)), args.qc_manifest)
+    reference_mesh = selection.load_vtk_polydata_mesh(args.reference)
+    distances = selection.compute_distances(reference_mesh, mesh_files)
+
+    if args.strategy == "clustering":
+        selected = selection.select_representative_meshes(distances, mesh_files, n_clusters=args.n_clusters)
+    else:
+        selected = selection.select_extreme_meshes(distances, mesh_files, top_n=args.n_extremes)
+
+    for f in selected:
+        print(f)
+    selection.copy_selected_meshes(selected, output_dir=args.output_dir)
+
+
+def cmd_deformetrica_xml(args):
+    utils = _import_stage("shapemodeling/deformetrica", "deformetrica_utils")
+    os.makedirs(args.output_dir, exist_ok=True)
+    utils.save_xml(utils.generate_xml_data(args.data_folder), os.path.join(args.output_dir, "data_set.xml"))
+    utils.save_xml(utils.generate_xml_model(args.kernel_width, args.cp_spacing, k_type=args.kernel_type,
+                                            k_device=args.kernel_device),
+                   os.path.join(args.output_dir, "model.xml"))
+    utils.save_xml(utils.generate_xml_optimization(converge_tol=args.convergence_tolerance, max_iter=args.max_iter,
+                                                   optimization_method=args.optimizer),
+                   os.path.join(args.output_dir, "optimization_parameters.xml"))
+
+
+def cmd_kernel_distance(args):
+    distances = _import_stage("shapemodeling/deformetrica", "kernel_distances")
+    pairs = _read_table(args.pairs)
+    mesh_pairs = list(zip(pairs.iloc[:, 0], pairs.iloc[:, 1]))
+    pairs[f"{args.kind}_distance"] = distances.paired_kernel_distances(
+        mesh_pairs, args.kernel_width, kind=args.kind, block_size=args.block_size, n_jobs=args.n_jobs)
+
+    print(pairs.to_string(index=False))
+    if args.output:
+        pairs.to_csv(args.output, index=False)
+        print(f"Saved distances to: {args.output}")
+
+
+def cmd_ssm(args):
+    ssm = _import_stage("shapemodeling/ssm", "shape_modeling_ssm")
+    ssm.run_ssm(args.input_dir, args.output_dir, image_output_path=args.plot,
+                variance_threshold=args.variance_threshold, alignment=args.alignment,
+                multires_levels=tuple(args.multires_levels))
+
+
+def cmd_evaluate_ssm(args):
+    evaluation = _import_stage("shapemodeling/ssm", "ssm_evaluation")
+    evaluation.evaluate_ssm(args.input_dir, args.output_dir, image_output_path=args.plot, max_modes=args.max_modes,
+                            n_samples=args.n_samples, n_jobs=args.n_jobs, seed=args.seed)
+
+
+def cmd_update_ssm(args):
+    incremental = _import_stage("shapemodeling/ssm", "incremental_ssm")
+    incremental.update_ssm(args.model_dir, args.input_dir, args.output_dir, n_samples=args.n_samples,
+                           max_modes=args.max_modes, reexpress=not args.keep_coefficients)
+
+
+def cmd_stats(args):
+    statistics = _import_stage("shapeanalysis/statistical_analysis", "permutation_statistics")
+    table = _read_table(args.table)
+    columns = [args.label] + args.covariates + _mode_columns(args.mode_prefix, args.n_modes)
+    table = table.dropna(subset=columns)
+
+    covariates = table[args.covariates] if args.covariates else None
+    results = statistics.permutation_test(table[_mode_columns(args.mode_prefix, args.n_modes)], table[args.label],
+                                          covariates=covariates, n_permutations=args.n_permutations,
+                                          chunk_size=args.chunk_size, n_jobs=args.n_jobs, seed=args.seed)
+
+    print(f"Pillai's trace: {results['pillai']:.4f}")
+    print(f"Hotelling's T²: {results['hotelling_t2']:.2f}")
+    print(f"F({results['num_df']}, {results['den_df']}) = {results['f_value']:.2f}, "
+          f"parametric p = {results['p_parametric']:.4g}")
+    print(f"Permutation p ({results['n_permutations']} permutations) = {results['p_permutation']:.4g}")
+    print(results["modes"].to_string(index=False))
+
+    if args.output:
+        results["modes"].to_csv(args.output, index=False)
+        print(f"Saved per-mode results to: {args.output}")
+
+
+def cmd_nearest_shapes(args):
+    shape_index = _import_stage("shapeanalysis/statistical_analysis", "shape_index")
+    if args.model_dir:
+        metadata = _read_table(args.metadata) if args.metadata else None
+        ids = metadata[args.id_column] if metadata is not None and args.id_column else None
+        index = shape_index.ShapeIndex.from_ssm(args.model_dir, ids=ids, metadata=metadata, n_modes=args.n_modes,
+                                                method=args.method)
+        if args.index:
+            index.save(args.index)
+            print(f"Saved index of {len(index)} subjects to: {args.index}")
+    elif args.index:
+        index = shape_index.ShapeIndex.load(args.index)
+    else:
+        raise SystemExit("nearest-shapes: give --model-dir to build an index or --index to load one")
+
+    if not args.query:
+        return
+    ids = [type(index.ids[0].item())(subject) for subject in args.query]
+    where = {}
+    for condition in args.where:
+        column, value = condition.split("=", 1)
+        values = [_parse_value(v) for v in value.split(",")]
+        where[column] = values if len(values) > 1 else values[0]
+
+    results = index.query_ids(ids, k=args.k, where=where or None)
+    print(results.to_string(index=False))
+    if args.output:
+        results.to_csv(args.output, index=False)
+        print(f"Saved neighbours to: {args.output}")
+
+
+def cmd_reconstruct(args):
+    reconstruction = _import_stage("shapeanalysis/visualization", "shape_reconstruction")
+    table = _read_table(args.table)
+    if args.id_column:
+        table = table.set_index(args.id_column)
+    coefficients = table[_mode_columns(args.mode_prefix, args.n_modes)]
+    reconstruction.reconstruct_cohort(args.model_dir, coefficients, args.output_dir, units=args.units)
+
+
+def cmd_visualize_mode(args):
+    visualization = _import_stage("shapeanalysis/visualization", "ssm_sd_visualization")
+    visualization.visualize_mode(args.model_dir, which_mode=args.mode - 1, how_much_std=args.n_std)
+
+
+def cmd_animate_mode(args):
+    animation = _import_stage("shapeanalysis/visualization", "ssm_animation")
+    animation.animate_mode(args.model_dir, which_mode=args.mode - 1, n_frames=args.n_frames,
+                           how_much_std=args.n_std, pause_at_ends=args.pause_at_ends,
+                           export_animation=args.output is not None, output_path=args.output)
+
+
+# === Argument parsing ===
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="pipeline.py", description="Cardiac statistical shape modeling pipeline.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", help="JSON or TOML file with option values (flat or in a [<subcommand>] section)")
+
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="<command>")
+    commands = {}
+
+    def add(name, func, help_text, required=()):
+        sub = subparsers.add_parser(name, parents=[common], help=help_text, description=help_text)
+        sub.set_defaults(func=func, required_options=required)
+        commands[name] = sub
+        return sub
+
+    # --- Mesh processing ---
+    sub = add("extract-biventricular", cmd_extract_biventricular,
+              "Create the epicardial shell, then extract, smooth and remesh biventricular meshes (3D Slicer).",
+              required=("input_dir",))
+    sub.add_argument("--input-dir", help="root directory of the segmentations, or a .zip/.tar archive of them")
+    sub.add_argument("--output", help="output directory or .zip/.tar archive (archive input only)")
+    sub.add_argument("--read-ahead", type=int, default=4, help="archive members decoded ahead (archive input only)")
+    sub.add_argument("--label-name", default="Segment_2")
+    sub.add_argument("--dilation-radius-mm", type=float, default=3)
+    sub.add_argument("--padding", type=int, default=10)
+    sub.add_argument("--n-iter", type=int, default=100, help="smoothing iterations")
+    sub.add_argument("--target-node-count", type=int, default=10000)
+
+    sub = add("extract-label", cmd_extract_label,
+              "Extract, smooth and remesh meshes of a single segmentation label (3D Slicer).",
+              required=("input_dir",))
+    sub.add_argument("--input-dir", help="root directory of the segmentations, or a .zip/.tar archive of them")
+    sub.add_argument("--output", help="output directory or .zip/.tar archive (archive input only)")
+    sub.add_argument("--read-ahead", type=int, default=4, help="archive members decoded ahead (archive input only)")
+    sub.add_argument("--label-name", default="Segment_1")
+    sub.add_argument("--input-suffix", default=".nii.gz")
+    sub.add_argument("--output-suffix", default="_mesh.vtk")
+    sub.add_argument("--n-iter", type=int, default=100, help="smoothing iterations")
+    sub.add_argument("--target-node-count", type=int, default=10000)
+
+    sub = add("extract-labels", cmd_extract_labels,
+              "Extract, smooth and remesh several labels from a single load of each segmentation.",
+              required=("input_dir",))
+    sub.add_argument("--input-dir", help="root directory of the segmentations")
+    sub.add_argument("--label-names", nargs="+", default=["Segment_1", "Segment_2", "Segment_3"])
+    sub.add_argument("--input-suffix", default=".nii.gz")
+    sub.add_argument("--output-suffix", default="_mesh.vtk")
+    sub.add_argument("--n-iter", type=int, default=100, help="smoothing iterations")
+    sub.add_argument("--target-node-count", type=int, help="remesh each label to this vertex count")
+    sub.add_argument("--merge", action="store_true", help="write one labelled mesh instead of one mesh per label")
+    sub.add_argument("--shared-interfaces", action="store_true",
+                     help="share vertices at label interfaces (vtkSurfaceNets3D, no 3D Slicer needed)")
+    sub.add_argument("--n-jobs", type=int, help="threads for concurrent smoothing/remeshing")
+
+    sub = add("remesh", cmd_remesh, "Remesh meshes to a uniform vertex count with pyacvd.", required=("input_dir",))
+    sub.add_argument("--input-dir")
+    sub.add_argument("--mesh-suffix", default="_mesh.vtk")
+    sub.add_argument("--target-node-count", type=int, default=10000)
+
+    sub = add("qc", cmd_qc, "Mesh quality metrics and a pass/fail manifest for a cohort.", required=("input_dir",))
+    sub.add_argument("--input-dir")
+    sub.add_argument("--mesh-suffix", default="_mesh.vtk")
+    sub.add_argument("--target-node-count", type=int, help="expected vertex count after remeshing")
+    sub.add_argument("--node-count-tolerance", type=float, default=0.05, help="allowed relative vertex count deviation")
+    sub.add_argument("--max-aspect-ratio", type=float, default=20.0)
+    sub.add_argument("--max-boundary-edges", type=int, default=0, help="allowed boundary edges (0 for closed surfaces)")
+    sub.add_argument("--max-components", type=int, default=1)
+    sub.add_argument("--metrics-csv", default="mesh_qc_metrics.csv")
+    sub.add_argument("--manifest", default="mesh_qc_manifest.csv")
+    sub.add_argument("--n-jobs", type=int, help="worker processes")
+
+    sub = add("medoid", cmd_medoid, "Pre-align a mesh population and find its medoid.", required=("input_dir",))
+    sub.add_argument("--input-dir")
+    sub.add_argument("--mesh-suffix", default="mesh.vtk")
+    sub.add_argument("--log-path", default="medoid_log.csv")
+    sub.add_argument("--skip-pre-align", action="store_true", help="meshes are already pre-aligned")
+    sub.add_argument("--qc-manifest", help="skip meshes that failed QC in this manifest (see qc)")
+
+    sub = add("align", cmd_align, "Rigidly align meshes to a template with ICP (in place).",
+              required=("input_dir", "reference"))
+    sub.add_argument("--input-dir")
+    sub.add_argument("--reference", help="template mesh (.vtk)")
+    sub.add_argument("--mesh-suffix", default="mesh.vtk")
+    sub.add_argument("--transform-log", default="icp_transforms.csv")
+    sub.add_argument("--qc-manifest", help="skip meshes that failed QC in this manifest (see qc)")
+    sub.add_argument("--multires-levels", type=float, nargs="+",
+                     help="coarse-to-fine mesh fractions, e.g. 0.02 0.1 1.0 (default: single-level ICP)")
+    sub.add_argument("--multires-iterations", type=int, nargs="+", help="ICP iterations per level")
+    sub.add_argument("--validate", action="store_true", help="compare multi-resolution transforms with single-level ICP")
+    sub.add_argument("--tolerance", type=float, default=1.0, help="warning threshold for --validate (mesh units)")
+
+    # --- Shape modeling ---
+    sub = add("select-cohort", cmd_select_cohort, "Select a Deformetrica optimization cohort.",
+              required=("input_dir", "reference"))
+    sub.add_argument("--input-dir")
+    sub.add_argument("--reference", help="template mesh (.vtk)")
+    sub.add_argument("--file-pattern", default="*.vtk")
+    sub.add_argument("--strategy", choices=("clustering", "extreme"), default="clustering")
+    sub.add_argument("--n-clusters", type=int, default=5)
+    sub.add_argument("--n-extremes", type=int, default=15)
+    sub.add_argument("--output-dir", default="optimization_cohort")
+    sub.add_argument("--qc-manifest", help="skip meshes that failed QC in this manifest (see qc)")
+
+    sub = add("deformetrica-xml", cmd_deformetrica_xml, "Write Deformetrica data set, model and optimization XML files.",
+              required=("data_folder", "kernel_width", "cp_spacing"))
+    sub.add_argument("--data-folder", help="directory with the aligned .vtk meshes")
+    sub.add_argument("--output-dir", default=".")
+    sub.add_argument("--kernel-width", type=float)
+    sub.add_argument("--cp-spacing", type=float)
+    sub.add_argument("--kernel-type", default="keops")
+    sub.add_argument("--kernel-device", default="gpu")
+    sub.add_argument("--max-iter", type=int, default=150)
+    sub.add_argument("--convergence-tolerance", type=float, default=1e-5)
+    sub.add_argument("--optimizer", default="scipy-lbfgsb")
+
+    sub = add("kernel-distance", cmd_kernel_distance,
+              "Varifold or current distances between mesh pairs (Deformetrica attachment metric).",
+              required=("pairs", "kernel_width"))
+    sub.add_argument("--pairs", help="CSV whose first two columns are the paths of the meshes to compare")
+    sub.add_argument("--kernel-width", type=float)
+    sub.add_argument("--kind", choices=("varifold", "current"), default="varifold")
+    sub.add_argument("--block-size", type=int, default=2048, help="triangles per kernel tile (memory bound)")
+    sub.add_argument("--n-jobs", type=int)
+    sub.add_argument("--output", help="CSV with the input pairs and their distances")
+
+    sub = add("ssm", cmd_ssm, "Procrustes alignment and PCA of the reconstructed meshes.",
+              required=("input_dir", "output_dir"))
+    sub.add_argument("--input-dir", help="directory with DeterministicAtlas__Reconstruction__*.vtk meshes")
+    sub.add_argument("--output-dir")
+    sub.add_argument("--plot", help="save the variance plot here instead of showing it")
+    sub.add_argument("--variance-threshold", type=float, default=0.9)
+    sub.add_argument("--alignment", choices=("vtk", "multires"), default="vtk")
+    sub.add_argument("--multires-levels", type=float, nargs="+", default=[0.02, 0.1, 1.0],
+                     help="vertex fractions for --alignment multires")
+
+    sub = add("evaluate-ssm", cmd_evaluate_ssm, "Compactness, generalization and specificity of the SSM.",
+              required=("input_dir", "output_dir"))
+    sub.add_argument("--input-dir", help="directory with DeterministicAtlas__Reconstruction__*.vtk meshes")
+    sub.add_argument("--output-dir")
+    sub.add_argument("--plot", help="save the metrics plot here instead of showing it")
+    sub.add_argument("--max-modes", type=int, default=30)
+    sub.add_argument("--n-samples", type=int, default=1000, help="model instances for specificity")
+    sub.add_argument("--n-jobs", type=int)
+    sub.add_argument("--seed", type=int, default=0)
+
+    sub = add("update-ssm", cmd_update_ssm, "Add new subjects to an existing SSM with an incremental SVD.",
+              required=("model_dir", "input_dir", "output_dir"))
+    sub.add_argument("--model-dir", help="existing model (outputs of ssm)")
+    sub.add_argument("--input-dir", help="directory with the new DeterministicAtlas__Reconstruction__*.vtk meshes")
+    sub.add_argument("--output-dir")
+    sub.add_argument("--n-samples", type=int, help="subjects in the existing model (default: rows of shape_coefficients.csv)")
+    sub.add_argument("--max-modes", type=int, help="modes to keep in the updated model")
+    sub.add_argument("--keep-coefficients", action="store_true",
+                     help="do not re-express the existing shape coefficients in the updated basis")
+
+    # --- Shape analysis ---
+    sub = add("stats", cmd_stats, "Parametric and permutation MANCOVA / Hotelling's T² of shape coefficients.",
+              required=("table",))
+    sub.add_argument("--table", help="CSV/XLSX with shape coefficients, group labels and covariates")
+    sub.add_argument("--label", default="Sex_binary", help="tested single-df column")
+    sub.add_argument("--covariates", nargs="*", default=[])
+    sub.add_argument("--mode-prefix", default="Mode_")
+    sub.add_argument("--n-modes", type=int, default=20)
+    sub.add_argument("--n-permutations", type=int, default=10000)
+    sub.add_argument("--chunk-size", type=int, default=250)
+    sub.add_argument("--n-jobs", type=int)
+    sub.add_argument("--seed", type=int, default=0)
+    sub.add_argument("--output", help="CSV for the per-mode results")
+
+    sub = add("nearest-shapes", cmd_nearest_shapes, "Build or query a nearest-neighbour index of shape coefficients.")
+    sub.add_argument("--model-dir", help="SSM output directory to index (shape_coefficients.csv, variance.csv)")
+    sub.add_argument("--index", help=".npz index to save (with --model-dir) or to load")
+    sub.add_argument("--metadata", help="CSV/XLSX with one row per subject, in shape_coefficients.csv order")
+    sub.add_argument("--id-column", help="metadata column with the subject IDs")
+    sub.add_argument("--n-modes", type=int, help="number of modes to index (default: all)")
+    sub.add_argument("--method", choices=("auto", "kdtree", "balltree", "brute"), default="auto")
+    sub.add_argument("--query", nargs="*", default=[], help="subject IDs to find neighbours for")
+    sub.add_argument("--k", type=int, default=5)
+    sub.add_argument("--where", nargs="*", default=[], help="metadata filters, e.g. Sex_binary=0 AgeBand=40-49,50-59")
+    sub.add_argument("--output", help="CSV for the neighbours")
+
+    sub = add("reconstruct", cmd_reconstruct, "Reconstruct meshes from a table of shape coefficients.",
+              required=("model_dir", "table", "output_dir"))
+    sub.add_argument("--model-dir", help="directory with mean_shape.vtk, pc.csv, variance.csv")
+    sub.add_argument("--table", help="CSV/XLSX with one row of coefficients per shape")
+    sub.add_argument("--output-dir")
+    sub.add_argument("--id-column", default="Subject_ID")
+    sub.add_argument("--mode-prefix", default="Mode_")
+    sub.add_argument("--n-modes", type=int, default=20)
+    sub.add_argument("--units", choices=("raw", "zscore", "sd"), default="raw")
+
+    sub = add("visualize-mode", cmd_visualize_mode, "Show the mean shape and ±N SD shapes of a mode.")
+    sub.add_argument("--model-dir", default="model")
+    sub.add_argument("--mode", type=int, default=1, help="mode number (1 = first mode)")
+    sub.add_argument("--n-std", type=float, default=3)
+
+    sub = add("animate-mode", cmd_animate_mode, "Animate the deformation along a mode.")
+    sub.add_argument("--model-dir", default="model")
+    sub.add_argument("--mode", type=int, default=1, help="mode number (1 = first mode)")
+    sub.add_argument("--n-std", type=float, default=3)
+    sub.add_argument("--n-frames", type=int, default=30)
+    sub.add_argument("--pause-at-ends", type=int, default=5)
+    sub.add_argument("--output", help="export the animation (.gif/.mp4) instead of showing it")
+
+    return parser, commands
+
+
+def parse_args(argv=None):
+    parser, commands = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.config:
+        config = _load_config(args.config)
+        config = config.get(args.command, config)
+        subparser = commands[args.command]
+        known = {action.dest for action in subparser._actions}
+        values = {key.replace("-", "_"): value for key, value in config.items() if not isinstance(value, dict)}
+        unknown = sorted(set(values) - known)
+        if unknown:
+            subparser.error(f"unknown option(s) in {args.config}: {', '.join(unknown)}")
+        subparser.set_defaults(**values)
+        args = parser.parse_args(argv)
+
+    missing = [name for name in args.required_options if getattr(args, name) is None]
+    if missing:
+        commands[args.command].error(
+            "missing required option(s): " + ", ".join("--" + name.replace("_", "-") for name in missing))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+# permutation_statistics.py
+
+"""
+Parametric and permutation-based group tests on SSM shape coefficients.
+
+The shape coefficients Y (subjects x modes) are modelled as
+Y = [Z, x] B + E, where Z holds the nuisance design (intercept plus covariates
+such as age, blood pressure and body size) and x is the tested single-df
+regressor (e.g. Sex_binary). By the Frisch-Waugh-Lovell theorem the test of x
+only depends on Y and x after residualizing against Z, so the residualized
+shape matrix and its whitening are computed once. Every label permutation then
+reduces to a matrix product, and thousands of permutations are evaluated as
+batched linear algebra, chunked across worker processes.
+
+Reported statistics:
+- Pillai's trace (MANCOVA, as in statsmodels' MANOVA.mv_test)
+- Hotelling's T² (identical to the two-sample test when no covariates are given)
+- Per-mode t-statistics of the tested regressor, with max-T (FWER) correction
+
+Permutations shuffle the tested labels while keeping the covariates fixed
+(Draper-Stoneman scheme), so each permuted statistic is exactly the statistic
+of a refitted model.
+
+Dependencies:
+- numpy
+- scipy
+- pandas
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+_WORKER_STATE = None
+
+
+def _as_matrix(values):
+    matrix = np.asarray(values, dtype=float)
+    if matrix.ndim == 1:
+        matrix = matrix[:, None]
+    return matrix
+
+
+def _column_names(values, prefix):
+    if isinstance(values, pd.DataFrame):
+        return [str(c) for c in values.columns]
+    if isinstance(values, pd.Series):
+        return [str(values.name)]
+    return [f"{prefix}{i + 1}" for i in range(_as_matrix(values).shape[1])]
+
+
+def _nuisance_design(n_subjects, covariates=None):
+    Z = np.ones((n_subjects, 1))
+    if covariates is not None:
+        Z = np.hstack([Z, _as_matrix(covariates)])
+    return Z
+
+
+def _precompute(shape_scores, nuisance):
+    """Residualize the shape scores against the nuisance design once."""
+    Y = _as_matrix(shape_scores)
+    Q, _ = np.linalg.qr(nuisance)
+
+    Y_res = Y - Q @ (Q.T @ Y)
+    total_sscp = Y_res.T @ Y_res
+    chol = np.linalg.cholesky(total_sscp)
+
+    return {
+        "Q": Q,
+        "Y_res": Y_res,
+        # whitened' x = L^-1 Yr' x, so Pillai's trace is ||whitened' x||^2 / (xr' xr)
+        "whitened": np.linalg.solve(chol, Y_res.T).T,
+        "mode_ss": np.diag(total_sscp).copy(),
+        "df_error": Y.shape[0] - Q.shape[1] - 1,
+    }
+
+
+def _batch_statistics(state, X):
+    """Pillai's trace and per-mode t for each column of X (subjects x batch)."""
+    QtX = state["Q"].T @ X
+    sxx = np.einsum("ij,ij->j", X, X) - np.einsum("ij,ij->j", QtX, QtX)
+
+    projected = state["whitened"].T @ X
+    pillai = np.einsum("ij,ij->j", projected, projected) / sxx
+
+    cross = state["Y_res"].T @ X
+    rss = state["mode_ss"][:, None] - cross ** 2 / sxx
+    t_values = cross / np.sqrt(sxx * rss / state["df_error"])
+    return pillai, t_values
+
+
+def _pillai_f_test(pillai, n_modes, df_error):
+    """F transform of Pillai's trace for a single-df hypothesis (exact, s = 1)."""
+    num_df = n_modes
+    den_df = df_error - n_modes + 1
+    f_value = pillai / (1.0 - pillai) * den_df / num_df
+    return f_value, num_df, den_df, stats.f.sf(f_value, num_df, den_df)
+
+
+def hotelling_t2_test(group_a, group_b):
+    """
+    Two-sample Hotelling's T² test with pooled covariance.
+
+    Returns (t2, f_value, p_value), matching hotelling.stats.hotelling_t2.
+    """
+    A = _as_matrix(group_a)
+    B = _as_matrix(group_b)
+    labels = np.concatenate([np.ones(A.shape[0]), np.zeros(B.shape[0])])
+
+    state = _precompute(np.vstack([A, B]), _nuisance_design(labels.size))
+    pillai = _batch_statistics(state, labels[:, None])[0][0]
+
+    f_value, _, _, p_value = _pillai_f_test(pillai, A.shape[1], state["df_error"])
+    t2 = state["df_error"] * pillai / (1.0 - pillai)
+    return t2, f_value, p_value
+
+
+def mancova(shape_scores, design):
+    """
+    Multivariate test of every single-df term of a linear model with intercept.
+
+    shape_scores: subjects x modes (array or DataFrame)
+    design: subjects x terms (numeric DataFrame, e.g. Sex_binary, BMI, Age, Systolic BP)
+
+    Returns one row per term (including the intercept) with Pillai's trace,
+    F value, degrees of freedom and p-value, matching statsmodels'
+    MANOVA.from_formula(...).mv_test().
+    """
+    X = _nuisance_design(_as_matrix(design).shape[0], design)
+    terms = ["Intercept"] + _column_names(design, "x")
+    n_modes = _as_matrix(shape_scores).shape[1]
+
+    rows = []
+    for j, term in enumerate(terms):
+        state = _precompute(shape_scores, np.delete(X, j, axis=1))
+        pillai = _batch_statistics(state, X[:, j:j + 1])[0][0]
+        f_value, num_df, den_df, p_value = _pillai_f_test(pillai, n_modes, state["df_error"])
+        rows.append([term, pillai, f_value, num_df, den_df, p_value])
+
+    return pd.DataFrame(rows, columns=["Term", "Pillai's trace", "F Value", "Num DF", "Den DF", "Pr > F"])
+
+
+def _init_worker(state, labels, observed_pillai, observed_abs_t):
+    global _WORKER_STATE
+    _WORKER_STATE = (state, labels, observed_pillai, observed_abs_t)
+
+
+def _permutation_chunk(seed_sequence, n_permutations):
+    """Count permuted statistics at least as extreme as the observed ones."""
+    state, labels, observed_pillai, observed_abs_t = _WORKER_STATE
+    rng = np.random.default_rng(seed_sequence)
+
+    permutations = np.argsort(rng.random((n_permutations, labels.size)), axis=1)
+    pillai, t_values = _batch_statistics(state, labels[permutations].T)
+
+    abs_t = np.abs(t_values)
+    max_t = abs_t.max(axis=0)
+
+    pillai_count = int(np.sum(pillai >= observed_pillai))
+    mode_counts = np.sum(abs_t >= observed_abs_t[:, None], axis=1)
+    max_t_counts = np.sum(max_t[None, :] >= observed_abs_t[:, None], axis=1)
+    return pillai_count, mode_counts, max_t_counts
+
+
+def permutation_test(shape_scores, labels, covariates=None, n_permutations=10000,
+                     chunk_size=250, n_jobs=None, seed=0):
+    """
+    Permutation MANCOVA / Hotelling's T² of shape coefficients against a group label.
+
+    shape_scores: subjects x modes (array or DataFrame)
+    labels: tested single-df regressor per subject (e.g. Sex_binary)
+    covariates: optional subjects x covariates to adjust for (kept fixed under permutation)
+    chunk_size: permutations evaluated per batched matrix product
+    n_jobs: worker processes (None = all cores, 1 = run in the calling process)
+
+    Returns a dict with the observed Pillai's trace, Hotelling's T², parametric
+    F test, permutation p-value, and a per-mode DataFrame with t-values,
+    parametric, uncorrected permutation and max-T corrected p-values.
+    """
+    labels = np.asarray(labels, dtype=float).ravel()
+    n_modes = _as_matrix(shape_scores).shape[1]
+    state = _precompute(shape_scores, _nuisance_design(labels.size, covariates))
+
+    pillai, t_values = _batch_statistics(state, labels[:, None])
+    pillai = pillai[0]
+    t_values = t_values[:, 0]
+    observed_abs_t = np.abs(t_values)
+
+    f_value, num_df, den_df, p_parametric = _pillai_f_test(pillai, n_modes, state["df_error"])
+
+    chunks = [chunk_size] * (n_permutations // chunk_size)
+    if n_permutations % chunk_size:
+        chunks.append(n_permutations % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    print(f"Running {n_permutations} permutations in {len(chunks)} chunks on {n_jobs} process(es)...")
+
+    init_args = (state, labels, pillai, observed_abs_t)
+    if n_jobs == 1:
+        _init_worker(*init_args)
+        results = [_permutation_chunk(s, c) for s, c in zip(seeds, chunks)]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=init_args) as pool:
+            results = list(pool.map(_permutation_chunk, seeds, chunks))
+
+    pillai_count = sum(r[0] for r in results)
+    mode_counts = np.sum([r[1] for r in results], axis=0)
+    max_t_counts = np.sum([r[2] for r in results], axis=0)
+
+    modes = pd.DataFrame({
+        "Mode": _column_names(shape_scores, "Mode "),
+        "t": t_values,
+        "p_parametric": 2 * stats.t.sf(observed_abs_t, state["df_error"]),
+        "p_permutation": (mode_counts + 1) / (n_permutations + 1),
+        "p_maxT": (max_t_counts + 1) / (n_permutations + 1),
+    })
+
+    return {
+        "pillai": pillai,
+        "hotelling_t2": state["df_error"] * pillai / (1.0 - pillai),
+        "f_value": f_value,
+        "num_df": num_df,
+        "den_df": den_df,
+        "p_parametric": p_parametric,
+        "p_permutation": (pillai_count + 1) / (n_permutations + 1),
+        "n_permutations": n_permutations,
+        "modes": modes,
+    }
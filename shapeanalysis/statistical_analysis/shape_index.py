@@ -0,0 +1,254 @@
+# shape_index.py
+
+"""
+Nearest-neighbour search in SSM shape space, e.g. for matched-control selection or for
+picking representative subsets for the Deformetrica parameter optimization.
+
+Shape coefficients are whitened by the mode standard deviations (sqrt of variance.csv), so
+Euclidean distances in the index are Mahalanobis distances under the shape model. Searches
+are exact:
+- "kdtree" (scipy cKDTree) or "balltree" (scikit-learn) for a few modes,
+- "brute": batched matrix products over all subjects, which is faster than the trees once
+  ~10 or more whitened modes are indexed (the "auto" default picks between the two).
+
+New subjects can be added without rebuilding: they are kept in a buffer that is searched by
+brute force and merged into the tree once it grows past rebuild_threshold. Queries can be
+restricted to subjects matching metadata (e.g. sex or age band), and the index can be saved
+to and loaded from a single .npz file.
+
+Dependencies:
+- numpy
+- scipy
+- pandas
+- scikit-learn (optional, for method="balltree")
+"""
+
+import io
+import os
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+TREE_MAX_MODES = 10
+
+
+class ShapeIndex:
+    """
+    Exact k-nearest-neighbour index over whitened SSM shape coefficients.
+
+    coefficients: (n_subjects, n_modes), variances: eigenvalues of the modes (variance.csv),
+    ids: subject identifiers (default: row numbers), metadata: DataFrame with one row per subject.
+    """
+
+    def __init__(self, coefficients, variances, ids=None, metadata=None, method="auto", rebuild_threshold=1024):
+        coefficients = np.atleast_2d(np.asarray(coefficients, dtype=float))
+        n_modes = coefficients.shape[1]
+        self.scale = 1.0 / np.sqrt(np.asarray(variances, dtype=float)[:n_modes])
+        self.points = coefficients * self.scale
+        self.ids = np.asarray(ids if ids is not None else np.arange(len(coefficients)))
+        self.metadata = metadata.reset_index(drop=True) if metadata is not None else None
+
+        if method == "auto":
+            method = "kdtree" if n_modes <= TREE_MAX_MODES else "brute"
+        if method not in ("kdtree", "balltree", "brute"):
+            raise ValueError("Unsupported method: choose 'auto', 'kdtree', 'balltree' or 'brute'")
+        self.method = method
+        self.rebuild_threshold = rebuild_threshold
+        self._build()
+
+    @classmethod
+    def from_ssm(cls, model_dir, ids=None, metadata=None, n_modes=None, **kwargs):
+        """Index the shape_coefficients.csv of a model written by run_ssm."""
+        coefficients = np.loadtxt(os.path.join(model_dir, "shape_coefficients.csv"), delimiter=",", ndmin=2)
+        variances = np.loadtxt(os.path.join(model_dir, "variance.csv"), delimiter=",", ndmin=1)
+        return cls(coefficients[:, :n_modes], variances, ids=ids, metadata=metadata, **kwargs)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _build(self):
+        self._n_indexed = len(self.points)
+        self._norms = np.einsum("ij,ij->i", self.points, self.points)
+        if self.method == "kdtree":
+            self._tree = cKDTree(self.points)
+        elif self.method == "balltree":
+            from sklearn.neighbors import BallTree
+
+            self._tree = BallTree(self.points)
+
+    def add(self, coefficients, ids=None, metadata=None):
+        """Insert new subjects; the tree is rebuilt once rebuild_threshold subjects are pending."""
+        points = np.atleast_2d(np.asarray(coefficients, dtype=float)) * self.scale
+        if ids is None:
+            ids = np.arange(len(self.points), len(self.points) + len(points))
+        if (self.metadata is None) != (metadata is None):
+            raise ValueError("metadata must be given for all subjects or for none")
+
+        self.points = np.vstack([self.points, points])
+        self.ids = np.concatenate([self.ids, np.asarray(ids)])
+        self._norms = np.concatenate([self._norms, np.einsum("ij,ij->i", points, points)])
+        if metadata is not None:
+            self.metadata = pd.concat([self.metadata, metadata], ignore_index=True)
+
+        if self.method != "brute" and len(self.points) - self._n_indexed >= self.rebuild_threshold:
+            self._build()
+
+    def mask(self, where):
+        """
+        Boolean mask of the subjects matching where: {column: value}, {column: [values]} or
+        {column: callable returning a boolean Series}, combined with AND.
+        """
+        if self.metadata is None:
+            raise ValueError("The index has no metadata to filter on")
+        mask = np.ones(len(self.points), dtype=bool)
+        for column, condition in where.items():
+            values = self.metadata[column]
+            if callable(condition):
+                mask &= np.asarray(condition(values), dtype=bool)
+            elif isinstance(condition, (list, tuple, set, np.ndarray)):
+                mask &= values.isin(list(condition)).to_numpy()
+            else:
+                mask &= (values == condition).to_numpy()
+        return mask
+
+    def _brute_force(self, queries, k, rows=None, chunk_elements=2 ** 24):
+        """Exact k nearest rows (default: all subjects) per query, chunked to chunk_elements distances."""
+        if rows is None:
+            rows = np.arange(len(self.points))
+            points, norms = self.points, self._norms
+        else:
+            points, norms = self.points[rows], self._norms[rows]
+        k = min(k, len(rows))
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        chunk = max(1, chunk_elements // max(len(rows), 1))
+        for start in range(0, len(queries), chunk):
+            block = queries[start:start + chunk]
+            # |x - p|^2 up to the constant |x|^2
+            distances = block @ points.T
+            distances *= -2.0
+            distances += norms[None, :]
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k] if k < len(rows) else \
+                np.tile(np.arange(len(rows)), (len(block), 1))
+            indices[start:start + chunk] = nearest
+        indices = rows[indices]
+        return self._sorted(queries, indices)
+
+    def _sorted(self, queries, indices):
+        # Exact distances of the candidates, sorted per query
+        distances = np.linalg.norm(self.points[indices] - queries[:, None, :], axis=2)
+        order = np.argsort(distances, axis=1, kind="stable")
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+    def _search(self, queries, k):
+        if self.method == "brute":
+            return self._brute_force(queries, k)
+
+        k_tree = min(k, self._n_indexed)
+        _, indices = self._tree.query(queries, k=k_tree)
+        indices = np.asarray(indices).reshape(len(queries), k_tree)
+
+        if len(self.points) > self._n_indexed:
+            _, pending = self._brute_force(queries, k, np.arange(self._n_indexed, len(self.points)))
+            indices = np.hstack([indices, pending])
+        distances, indices = self._sorted(queries, indices)
+        return distances[:, :k], indices[:, :k]
+
+    def _search_filtered(self, queries, k, mask):
+        rows = np.flatnonzero(mask)
+        k = min(k, len(rows))
+        if k == 0:
+            return np.zeros((len(queries), 0)), np.zeros((len(queries), 0), dtype=np.int64)
+        selectivity = len(rows) / len(self.points)
+        if self.method == "brute" or selectivity < 0.2:
+            return self._brute_force(queries, k, rows)
+
+        # Over-fetch from the tree and keep the matching subjects; fall back where too few match
+        distances, indices = self._search(queries, int(np.ceil(2 * k / selectivity)) + k)
+        matches = mask[indices]
+        result_distances = np.empty((len(queries), k))
+        result_indices = np.empty((len(queries), k), dtype=np.int64)
+        for i in range(len(queries)):
+            hits = np.flatnonzero(matches[i])
+            if len(hits) >= k:
+                result_distances[i], result_indices[i] = distances[i, hits[:k]], indices[i, hits[:k]]
+            else:
+                d, j = self._brute_force(queries[i:i + 1], k, rows)
+                result_distances[i], result_indices[i] = d[0], j[0]
+        return result_distances, result_indices
+
+    def query(self, coefficients, k=5, where=None, exclude=None):
+        """
+        k nearest subjects to each row of coefficients (in the unwhitened SSM units).
+
+        where: metadata filter (see mask) or a boolean mask; exclude: subject ids to leave out
+        (e.g. the query subjects themselves). Returns (distances, ids), each (n_queries, k).
+        """
+        queries = np.atleast_2d(np.asarray(coefficients, dtype=float)) * self.scale
+        mask = None
+        if where is not None:
+            mask = self.mask(where) if isinstance(where, dict) else np.asarray(where, dtype=bool)
+        if exclude is not None:
+            mask = (mask if mask is not None else np.ones(len(self.points), dtype=bool)) & ~np.isin(self.ids, exclude)
+
+        if mask is None:
+            distances, indices = self._search(queries, min(k, len(self.points)))
+        else:
+            distances, indices = self._search_filtered(queries, k, mask)
+        return distances, self.ids[indices]
+
+    def query_ids(self, ids, k=5, where=None, exclude_self=True):
+        """Nearest neighbours of subjects already in the index, as a long-format DataFrame."""
+        ids = np.atleast_1d(ids)
+        positions = pd.Index(self.ids).get_indexer(ids)
+        if np.any(positions < 0):
+            raise KeyError(f"Subjects not in the index: {ids[positions < 0].tolist()}")
+
+        # One batched search for k + 1 neighbours, then drop each subject's own match
+        n_neighbours = k + 1 if exclude_self else k
+        queries = self.points[positions]
+        if where is None:
+            distances, indices = self._search(queries, min(n_neighbours, len(self.points)))
+        else:
+            mask = self.mask(where) if isinstance(where, dict) else np.asarray(where, dtype=bool)
+            distances, indices = self._search_filtered(queries, n_neighbours, mask)
+
+        keep = np.ones(indices.shape, dtype=bool)
+        if exclude_self:
+            keep = indices != positions[:, None]
+        # Rows without their own match (filtered out) keep the first k neighbours
+        ranks = np.cumsum(keep, axis=1)
+        keep &= ranks <= k
+        query_rows = np.broadcast_to(np.arange(len(ids))[:, None], indices.shape)[keep]
+        return pd.DataFrame({
+            "query": ids[query_rows],
+            "rank": ranks[keep],
+            "neighbour": self.ids[indices[keep]],
+            "distance": distances[keep],
+        })
+
+    def save(self, path):
+        """Save coefficients, ids, whitening and metadata to a single .npz file."""
+        metadata = self.metadata.to_json(orient="split") if self.metadata is not None else ""
+        # String ids from pandas are object arrays, which np.load only reads with pickle enabled
+        ids = self.ids.astype(str) if self.ids.dtype == object else self.ids
+        np.savez(path, points=self.points, ids=ids, scale=self.scale, metadata=np.array(metadata),
+                 method=np.array(self.method), rebuild_threshold=np.array(self.rebuild_threshold))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            metadata = str(data["metadata"])
+            metadata = pd.read_json(io.StringIO(metadata), orient="split", dtype=False, convert_dates=False) if metadata else None
+            return cls(data["points"] / data["scale"], 1.0 / data["scale"] ** 2, ids=data["ids"], metadata=metadata,
+                       method=str(data["method"]), rebuild_threshold=int(data["rebuild_threshold"]))
+
+
+if __name__ == "__main__":
+    # Cohort table with subject IDs and metadata, in the same order as shape_coefficients.csv
+    metadata = pd.read_excel("/path/to/cohort_metadata.xlsx")
+
+    index = ShapeIndex.from_ssm("/path/to/ssm_output", ids=metadata["Subject"], metadata=metadata, n_modes=20)
+    index.save("/path/to/shape_index.npz")
+
+    # Five most similar female hearts for each of two subjects
+    print(index.query_ids(metadata["Subject"][:2], k=5, where={"Sex_binary": 0}))
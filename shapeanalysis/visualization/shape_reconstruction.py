@@ -0,0 +1,232 @@
+"""
+Batched reconstruction of meshes from (covariate-corrected) shape coefficients.
+
+- Loads the SSM (mean shape, principal components, eigenvalues, training coefficients)
+- Converts coefficient tables from raw, z-scored (as in the statistical analysis notebook)
+  or SD units back to raw mode coefficients
+- Fits the shape coefficients against covariates (one multi-output least-squares fit) and
+  predicts coefficients for group means or arbitrary covariate grids
+- Reconstructs all shapes with a single matrix product with the loaded modes
+- Computes group-mean shape differences and per-vertex displacement maps
+  (magnitude and signed displacement along the mean-shape normals)
+- Writes the reconstructed meshes, with displacement maps as point data, as .vtk files
+
+Inputs (expected in the model directory):
+- mean_shape.vtk
+- pc.csv
+- variance.csv
+- shape_coefficients.csv (needed to undo z-scoring)
+
+Dependencies:
+- numpy
+- pandas
+- vtk
+- mesh_utils (custom)
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+from mesh_utils import load_vtk_polydata_mesh
+
+
+def load_ssm_model(model_dir):
+    """Load the SSM outputs of run_ssm into a dictionary."""
+    mean_mesh = load_vtk_polydata_mesh(os.path.join(model_dir, "mean_shape.vtk"))
+    model = {
+        "mean_mesh": mean_mesh,
+        "mean_points": vtk_to_numpy(mean_mesh.GetPoints().GetData()).astype(float),
+        "modes": np.loadtxt(os.path.join(model_dir, "pc.csv"), delimiter=",", ndmin=2),
+        "eigenvalues": np.loadtxt(os.path.join(model_dir, "variance.csv"), delimiter=",", ndmin=1),
+        "coefficients": None,
+    }
+
+    coefficient_file = os.path.join(model_dir, "shape_coefficients.csv")
+    if os.path.exists(coefficient_file):
+        model["coefficients"] = np.loadtxt(coefficient_file, delimiter=",", ndmin=2)
+    return model
+
+
+def to_raw_coefficients(coefficients, model, units="raw"):
+    """
+    Convert a (n_shapes, n_modes) coefficient table to raw mode coefficients.
+
+    units:
+    - "raw": projections onto the unit-norm modes, as in shape_coefficients.csv
+    - "zscore": coefficients standardized per mode against shape_coefficients.csv
+      (the normalization used in the statistical analysis notebook)
+    - "sd": multiples of the standard deviation of each mode (sqrt of the eigenvalue)
+    """
+    coefficients = np.asarray(coefficients, dtype=float)
+    n_modes = coefficients.shape[1]
+
+    if units == "raw":
+        return coefficients
+    if units == "sd":
+        return coefficients * np.sqrt(model["eigenvalues"][:n_modes])
+    if units == "zscore":
+        if model["coefficients"] is None:
+            raise ValueError("shape_coefficients.csv is required to undo z-scoring")
+        reference = model["coefficients"][:, :n_modes]
+        return coefficients * reference.std(axis=0, ddof=1) + reference.mean(axis=0)
+    raise ValueError("Unsupported units: choose 'raw', 'zscore' or 'sd'")
+
+
+def reconstruct_shapes(coefficients, model, units="raw"):
+    """Reconstruct all shapes at once. Returns an array of shape (n_shapes, n_points, 3)."""
+    raw = to_raw_coefficients(coefficients, model, units)
+    modes = model["modes"][:, :raw.shape[1]]
+    points = raw @ modes.T + model["mean_points"].reshape(1, -1)
+    return points.reshape(raw.shape[0], -1, 3)
+
+
+def fit_coefficient_regression(coefficients, design):
+    """
+    Least-squares fit of all shape coefficients against numeric covariates (with intercept).
+
+    coefficients: DataFrame (subjects x modes)
+    design: DataFrame (subjects x covariates), e.g. Sex_binary, Age, Systolic BP, BMI
+    Returns the coefficient matrix as a DataFrame (terms x modes).
+    """
+    X = np.hstack([np.ones((len(design), 1)), np.asarray(design, dtype=float)])
+    beta, *_ = np.linalg.lstsq(X, np.asarray(coefficients, dtype=float), rcond=None)
+    return pd.DataFrame(beta, index=["Intercept"] + list(design.columns), columns=coefficients.columns)
+
+
+def predict_coefficients(beta, grid):
+    """Predict shape coefficients for each row of a covariate grid (DataFrame)."""
+    X = np.hstack([np.ones((len(grid), 1)), grid[beta.index[1:]].to_numpy(dtype=float)])
+    return pd.DataFrame(X @ beta.to_numpy(), index=grid.index, columns=beta.columns)
+
+
+def regression_group_means(coefficients, design, group_column, covariate_values=None):
+    """
+    Regression-derived mean coefficients of each group at fixed covariate values.
+
+    Covariates other than group_column are held at covariate_values (dict), or at the
+    cohort mean when not given. Returns a DataFrame indexed by group level.
+    """
+    beta = fit_coefficient_regression(coefficients, design)
+    levels = np.sort(design[group_column].unique())
+
+    grid = pd.DataFrame([design.mean()] * len(levels), index=pd.Index(levels, name=group_column))
+    for column, value in (covariate_values or {}).items():
+        grid[column] = value
+    grid[group_column] = levels
+    return predict_coefficients(beta, grid)
+
+
+def point_normals(mesh):
+    """Per-point outward normals of a closed surface, without splitting points."""
+    normals = vtk.vtkPolyDataNormals()
+    normals.SetInputData(mesh)
+    normals.ComputePointNormalsOn()
+    normals.SplittingOff()
+    normals.ConsistencyOn()
+    normals.AutoOrientNormalsOn()
+    normals.Update()
+    return vtk_to_numpy(normals.GetOutput().GetPointData().GetNormals()).astype(float)
+
+
+def displacement_maps(shapes, reference_points, normals):
+    """
+    Per-vertex displacement of each shape with respect to a reference shape.
+
+    Returns (magnitude, normal_component), each of shape (n_shapes, n_points). The normal
+    component is positive for outward displacement along the reference normals.
+    """
+    displacement = shapes - reference_points[None]
+    magnitude = np.linalg.norm(displacement, axis=2)
+    normal_component = np.einsum("spk,pk->sp", displacement, normals)
+    return magnitude, normal_component
+
+
+def group_mean_difference(group_coefficients, model, group_a, group_b, units="raw"):
+    """
+    Shape difference between two group mean coefficient rows (e.g. from regression_group_means).
+
+    Returns (shape_a, shape_b, magnitude, normal_component), where the displacement maps
+    describe group_a relative to group_b.
+    """
+    shape_a, shape_b = reconstruct_shapes(group_coefficients.loc[[group_a, group_b]], model, units)
+    normals = point_normals(_mesh_with_points(model["mean_mesh"], shape_b))
+    magnitude, normal_component = displacement_maps(shape_a[None], shape_b, normals)
+    return shape_a, shape_b, magnitude[0], normal_component[0]
+
+
+def _mesh_with_points(template_mesh, points, point_data=None):
+    mesh = vtk.vtkPolyData()
+    mesh.DeepCopy(template_mesh)
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_to_vtk(np.ascontiguousarray(points), deep=True))
+    mesh.SetPoints(vtk_points)
+
+    for name, values in (point_data or {}).items():
+        array = numpy_to_vtk(np.ascontiguousarray(values), deep=True)
+        array.SetName(name)
+        mesh.GetPointData().AddArray(array)
+    return mesh
+
+
+def write_shapes(shapes, template_mesh, names, output_dir, point_data=None):
+    """
+    Write reconstructed shapes as .vtk meshes sharing the template connectivity.
+
+    point_data: optional dict of array name -> (n_shapes, n_points) values.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    point_data = point_data or {}
+    writer = vtk.vtkPolyDataWriter()
+
+    for i, name in enumerate(names):
+        mesh = _mesh_with_points(template_mesh, shapes[i], {k: v[i] for k, v in point_data.items()})
+        writer.SetFileName(os.path.join(output_dir, f"{name}.vtk"))
+        writer.SetInputData(mesh)
+        writer.Write()
+    print(f"Saved {len(names)} reconstructed meshes to: {output_dir}")
+
+
+def reconstruct_cohort(model_dir, coefficients, output_dir, units="raw", names=None):
+    """
+    Reconstruct every row of a coefficient table and write the meshes with displacement maps.
+
+    coefficients: DataFrame (rows = shapes, columns = modes); the index is used for the
+    file names unless names are given.
+    """
+    model = load_ssm_model(model_dir)
+    shapes = reconstruct_shapes(coefficients, model, units)
+    magnitude, normal_component = displacement_maps(
+        shapes, model["mean_points"], point_normals(model["mean_mesh"]))
+
+    names = names if names is not None else [str(i) for i in coefficients.index]
+    write_shapes(shapes, model["mean_mesh"], names, output_dir, {
+        "Displacement": magnitude,
+        "NormalDisplacement": normal_component,
+    })
+    return shapes
+
+
+if __name__ == "__main__":
+    # === User Parameters ===
+    model_dir = "model"
+    corrected_scores_file = "corrected_shape_scores.xlsx"  # exported by the statistical analysis notebook
+    output_dir = "reconstructed_meshes"
+    mode_columns = [f"bmi_corrected_Mode_{i}" for i in range(1, 21)]
+    covariates = ["Sex_binary", "Age", "Systolic_BP_mean_reading", "BMI"]
+
+    scores = pd.read_excel(corrected_scores_file).set_index("Subject_ID")
+    model = load_ssm_model(model_dir)
+
+    # Covariate-corrected shape of every subject
+    reconstruct_cohort(model_dir, scores[mode_columns], os.path.join(output_dir, "subjects"), units="zscore")
+
+    # Male vs female mean shapes at the cohort-mean age, BP and BMI
+    raw_modes = [f"Mode_{i}" for i in range(1, 21)]
+    group_means = regression_group_means(scores[raw_modes], scores[covariates], "Sex_binary")
+    male, female, magnitude, normal_component = group_mean_difference(group_means, model, 1, 0, units="zscore")
+    write_shapes(np.stack([male, female]), model["mean_mesh"], ["male_mean", "female_mean"], output_dir, {
+        "Displacement": np.stack([magnitude, magnitude]),
+        "NormalDisplacement": np.stack([normal_component, -normal_component]),
+    })
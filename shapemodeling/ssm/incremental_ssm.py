@@ -0,0 +1,237 @@
+"""
+Incrementally updates an existing statistical shape model (SSM) with a batch of new subjects.
+
+Instead of re-aligning and re-decomposing the whole cohort, the new shapes are rigidly
+aligned to the current mean shape and merged into the model with an incremental SVD
+(Ross et al., 2008, with mean update). The cost scales with the number of new subjects and
+stored modes, not with the size of the original cohort.
+
+Steps:
+1. Load the model (mean shape, modes, eigenvalues, sample count)
+2. Align the new meshes to the mean shape and update mean, modes and eigenvalues
+3. Report how much each existing mode rotated (and match mode signs to the old model)
+4. Optionally re-express the existing shape coefficients in the updated basis
+
+The update is exact when the stored modes span the centered training data (all N - 1
+non-degenerate modes written by run_ssm); with a truncated basis it is the standard
+incremental PCA approximation.
+
+Outputs (in the output directory):
+- mean_shape.vtk, pc.csv, variance.csv — updated model, same format as run_ssm
+- mode_rotation.csv — per-mode rotation of the existing modes
+- new_shape_coefficients.csv — coefficients of the new subjects
+- shape_coefficients.csv — all subjects in the updated basis (if re-expressed)
+
+Coefficients of the new subjects follow run_ssm: the input meshes (not the aligned shapes) are
+projected on the modes, with as many modes as the existing shape_coefficients.csv. Since
+run_ssm only stores the modes explaining 90% of the variance, re-expressed existing
+coefficients are approximate unless the table holds all N - 1 modes.
+
+Dependencies:
+- vtk
+- numpy
+- pandas
+- shape_modeling_ssm / mesh_utils (custom)
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+from mesh_utils import load_vtk_polydata_mesh
+from shape_modeling_ssm import ensure_dir, find_mesh_files, rigid_align
+
+
+def load_model(model_dir, n_samples=None):
+    """
+    Load the outputs of run_ssm. The sample count defaults to the number of rows of
+    shape_coefficients.csv.
+    """
+    mean_mesh = load_vtk_polydata_mesh(os.path.join(model_dir, "mean_shape.vtk"))
+    coefficient_file = os.path.join(model_dir, "shape_coefficients.csv")
+    coefficients = np.loadtxt(coefficient_file, delimiter=",", ndmin=2) if os.path.exists(coefficient_file) else None
+
+    if n_samples is None:
+        if coefficients is None:
+            raise ValueError("n_samples must be given when shape_coefficients.csv is not available")
+        n_samples = coefficients.shape[0]
+
+    return {
+        "mean_mesh": mean_mesh,
+        "mean": vtk_to_numpy(mean_mesh.GetPoints().GetData()).astype(float).flatten(),
+        "modes": np.loadtxt(os.path.join(model_dir, "pc.csv"), delimiter=",", ndmin=2),
+        "eigenvalues": np.loadtxt(os.path.join(model_dir, "variance.csv"), delimiter=",", ndmin=1),
+        "n_samples": n_samples,
+        "coefficients": coefficients,
+    }
+
+
+def nondegenerate_modes(modes, eigenvalues, rtol=1e-10):
+    """
+    Drop modes with (numerically) zero eigenvalue. vtkPCAAnalysisFilter writes N modes for N
+    shapes; the last one spans no variance and is not orthogonal to the others.
+    """
+    keep = eigenvalues > rtol * eigenvalues.max()
+    return modes[:, keep], eigenvalues[keep]
+
+
+def incremental_pca_update(mean, modes, eigenvalues, n_samples, new_shapes, max_modes=None):
+    """
+    Merge new shapes (n_new, n_features) into a PCA model with an incremental SVD.
+
+    Eigenvalues follow vtkPCAAnalysisFilter (s^2 / (n - 1)); modes with zero eigenvalue are
+    dropped first, as the update requires an orthonormal basis. Returns
+    (mean, modes, eigenvalues, n_samples) of the updated model, keeping max_modes modes.
+    By default a model that stores all non-degenerate modes (N - 1 for N subjects) keeps all
+    of them, and a truncated model keeps its number of modes.
+    """
+    modes, eigenvalues = nondegenerate_modes(modes, eigenvalues)
+    n_new = new_shapes.shape[0]
+    n_total = n_samples + n_new
+    if max_modes is None:
+        max_modes = n_total - 1 if modes.shape[1] >= n_samples - 1 else modes.shape[1]
+
+    new_mean = new_shapes.mean(axis=0)
+    singular_values = np.sqrt(np.clip(eigenvalues, 0.0, None) * (n_samples - 1))
+
+    # New centered data plus the mean-shift correction column
+    extra = np.vstack([
+        new_shapes - new_mean,
+        np.sqrt(n_samples * n_new / n_total) * (new_mean - mean),
+    ]).T
+
+    projection = modes.T @ extra
+    residual = extra - modes @ projection
+    Q, R = np.linalg.qr(residual)
+
+    k = modes.shape[1]
+    small = np.zeros((k + Q.shape[1], k + extra.shape[1]))
+    small[:k, :k] = np.diag(singular_values)
+    small[:k, k:] = projection
+    small[k:, k:] = R
+
+    U_small, updated_singular_values, _ = np.linalg.svd(small, full_matrices=False)
+    keep = min(max_modes, updated_singular_values.size)
+    updated_modes = np.hstack([modes, Q]) @ U_small[:, :keep]
+
+    updated_mean = (n_samples * mean + n_new * new_mean) / n_total
+    updated_eigenvalues = updated_singular_values[:keep] ** 2 / (n_total - 1)
+    return updated_mean, updated_modes, updated_eigenvalues, n_total
+
+
+def mode_rotation(old_modes, new_modes, old_eigenvalues=None, new_eigenvalues=None):
+    """
+    Compare updated modes with the existing ones and flip their signs to match.
+
+    Returns (sign-matched new modes, report DataFrame). The report lists, per existing mode,
+    the |cosine| and angle to the updated mode with the same index, the best matching updated
+    mode, and the largest principal angle between the subspaces spanned by modes 1..i.
+    """
+    k = min(old_modes.shape[1], new_modes.shape[1])
+    cosines = old_modes[:, :k].T @ new_modes[:, :k]
+
+    signs = np.where(np.diag(cosines) < 0, -1.0, 1.0)
+    new_modes = new_modes.copy()
+    new_modes[:, :k] *= signs
+    cosines *= signs[None, :]
+
+    diagonal = np.clip(np.abs(np.diag(cosines)), 0.0, 1.0)
+    subspace_angles = [
+        np.degrees(np.arccos(np.clip(np.linalg.svd(cosines[:i, :i], compute_uv=False).min(), 0.0, 1.0)))
+        for i in range(1, k + 1)
+    ]
+
+    report = pd.DataFrame({
+        "mode": np.arange(1, k + 1),
+        "cosine": diagonal,
+        "angle_deg": np.degrees(np.arccos(diagonal)),
+        "best_match": np.argmax(np.abs(cosines), axis=1) + 1,
+        "subspace_angle_deg": subspace_angles,
+    })
+    if old_eigenvalues is not None and new_eigenvalues is not None:
+        report["eigenvalue_old"] = old_eigenvalues[:k]
+        report["eigenvalue_new"] = new_eigenvalues[:k]
+    return new_modes, report
+
+
+def reexpress_coefficients(coefficients, old_mean, old_modes, new_mean, new_modes):
+    """
+    Map coefficients of the old model (x = old_mean + old_modes c) onto the updated basis.
+
+    Exact only for full-rank coefficients (all non-degenerate modes): with a truncated table,
+    as written by run_ssm, the shape variation in the omitted modes is lost.
+    """
+    n_coefficients = coefficients.shape[1]
+    basis_change = new_modes[:, :n_coefficients].T @ old_modes[:, :n_coefficients]
+    offset = new_modes[:, :n_coefficients].T @ (old_mean - new_mean)
+    return coefficients @ basis_change.T + offset
+
+
+def _save_model(output_dir, mean_mesh, mean, modes, eigenvalues):
+    mean_shape = vtk.vtkPolyData()
+    mean_shape.DeepCopy(mean_mesh)
+    points = vtk.vtkPoints()
+    points.SetData(numpy_to_vtk(np.ascontiguousarray(mean.reshape(-1, 3)), deep=True))
+    mean_shape.SetPoints(points)
+
+    writer = vtk.vtkPolyDataWriter()
+    writer.SetFileName(os.path.join(output_dir, "mean_shape.vtk"))
+    writer.SetInputData(mean_shape)
+    writer.Write()
+
+    np.savetxt(os.path.join(output_dir, "pc.csv"), modes, delimiter=",")
+    np.savetxt(os.path.join(output_dir, "variance.csv"), eigenvalues, delimiter=",")
+
+
+def update_ssm(model_dir, input_dir, output_dir, n_samples=None, max_modes=None, reexpress=True):
+    """
+    Update the model in model_dir with the new reconstructed meshes in input_dir and write
+    the updated model to output_dir.
+    """
+    ensure_dir(output_dir)
+    model = load_model(model_dir, n_samples)
+
+    mesh_files = find_mesh_files(input_dir)
+    print(f"Found {len(mesh_files)} new mesh files; existing model has {model['n_samples']} subjects.")
+
+    new_points = np.array([
+        vtk_to_numpy(load_vtk_polydata_mesh(f).GetPoints().GetData()).astype(float) for f in mesh_files
+    ])
+    aligned, _, _ = rigid_align(new_points, model["mean"].reshape(-1, 3))
+    new_shapes = aligned.reshape(len(mesh_files), -1)
+
+    old_modes, old_eigenvalues = nondegenerate_modes(model["modes"], model["eigenvalues"])
+    mean, modes, eigenvalues, n_total = incremental_pca_update(
+        model["mean"], old_modes, old_eigenvalues, model["n_samples"], new_shapes, max_modes)
+    modes, report = mode_rotation(old_modes, modes, old_eigenvalues, eigenvalues)
+
+    _save_model(output_dir, model["mean_mesh"], mean, modes, eigenvalues)
+    report.to_csv(os.path.join(output_dir, "mode_rotation.csv"), index=False)
+    print(f"Updated model with {n_total} subjects.")
+    print(report.head(20).to_string(index=False))
+
+    # Same convention as run_ssm, which projects the input meshes (not the aligned shapes),
+    # so that the rows of the merged coefficient table are comparable
+    n_coefficients = model["coefficients"].shape[1] if model["coefficients"] is not None else modes.shape[1]
+    new_coefficients = (new_points.reshape(len(mesh_files), -1) - mean) @ modes[:, :n_coefficients]
+    np.savetxt(os.path.join(output_dir, "new_shape_coefficients.csv"), new_coefficients, delimiter=",")
+
+    if reexpress and model["coefficients"] is not None:
+        if n_coefficients < old_modes.shape[1]:
+            print(f"Warning: shape_coefficients.csv stores {n_coefficients} of {old_modes.shape[1]} modes; the "
+                  "shape variation in the other modes is lost, so the re-expressed coefficients are approximate.")
+        old_coefficients = reexpress_coefficients(model["coefficients"], model["mean"], old_modes, mean, modes)
+        np.savetxt(os.path.join(output_dir, "shape_coefficients.csv"),
+                   np.vstack([old_coefficients, new_coefficients]), delimiter=",")
+        print("Re-expressed existing shape coefficients in the updated basis.")
+
+    return report
+
+
+if __name__ == "__main__":
+    update_ssm(
+        model_dir="/path/to/model",  # outputs of run_ssm
+        input_dir="/path/to/new_meshes",  # new DeterministicAtlas__Reconstruction__*.vtk meshes
+        output_dir="/path/to/updated_model",
+    )
@@ -0,0 +1,200 @@
+"""
+Evaluates the quality of the statistical shape model (SSM) as a function of the number of modes.
+
+Metrics (Davies et al.; Styner et al.):
+1. Compactness: cumulative fraction of variance captured by the first M modes
+2. Generalization: leave-one-out reconstruction error of unseen shapes using M modes
+3. Specificity: distance of random model instances (M modes) to the closest training shape
+
+All shapes lie in the span of the centered data, so every metric is computed in the
+(n_subjects - 1)-dimensional PCA coordinate space without touching the full vertex arrays:
+- Leaving out subject i is a rank-one downdate of the scatter matrix,
+  S_-i = S - N / (N - 1) * d_i d_i^T, solved as a small eigenproblem instead of a PCA refit.
+- Distances between model instances and training shapes are a single matrix product.
+
+Distances are reported as RMS point-to-point distances (same units as the meshes, e.g. mm).
+
+Dependencies:
+- vtk
+- numpy
+- pandas
+- matplotlib
+- shape_modeling_ssm / mesh_utils (custom)
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from matplotlib.cm import viridis
+from mesh_utils import load_vtk_polydata_mesh
+from shape_modeling_ssm import ensure_dir, find_mesh_files, procrustes_align, aligned_shape_matrix
+
+
+def pca_coordinates(shapes):
+    """
+    Exact PCA of a (n_subjects, n_features) shape matrix in its own span.
+
+    Returns (coordinates, eigenvalues) where coordinates are the per-subject scores
+    on all non-degenerate modes and eigenvalues follow vtkPCAAnalysisFilter (s^2 / (N - 1)).
+    """
+    centered = shapes - shapes.mean(axis=0)
+    U, s, _ = np.linalg.svd(centered, full_matrices=False)
+    rank = int(np.sum(s > s[0] * 1e-10))
+    return U[:, :rank] * s[:rank], s[:rank] ** 2 / (shapes.shape[0] - 1)
+
+
+def compactness(eigenvalues, n_subjects, mode_counts):
+    """Cumulative variance fraction and its standard error for each number of modes."""
+    idx = np.asarray(mode_counts) - 1
+    total = eigenvalues.sum()
+    cumulative = np.cumsum(eigenvalues) / total
+    std = np.cumsum(np.sqrt(2.0 / n_subjects) * eigenvalues) / total
+    return cumulative[idx], std[idx]
+
+
+def _leave_one_out_errors(coordinates, subject_indices, mode_counts, n_points):
+    n_subjects = coordinates.shape[0]
+    scale = n_subjects / (n_subjects - 1)
+    scatter = np.sum(coordinates ** 2, axis=0)
+    # The leave-one-out scatter has one rank less; its null eigenvector is not a mode of the
+    # model (it would absorb the held-out subject), so larger mode counts use all modes
+    idx = np.minimum(mode_counts, coordinates.shape[1] - 1) - 1
+
+    errors = np.empty((len(subject_indices), len(mode_counts)))
+    for row, i in enumerate(subject_indices):
+        a = coordinates[i]
+        # Rank-one downdate of the diagonal scatter matrix in the PCA basis
+        downdated = np.diag(scatter) - scale * np.outer(a, a)
+        _, rotation = np.linalg.eigh(downdated)
+        rotation = rotation[:, ::-1]
+
+        # Subject relative to the leave-one-out mean: x_i - m_-i = N / (N - 1) * (x_i - m)
+        b = scale * a
+        captured = np.cumsum((rotation.T @ b) ** 2)
+        residual = np.clip(b @ b - captured[idx], 0.0, None)
+        errors[row] = np.sqrt(residual / n_points)
+    return errors
+
+
+def generalization(coordinates, mode_counts, n_points, n_jobs=None):
+    """
+    Leave-one-out generalization error for each number of modes.
+
+    A model of N - 1 subjects has at most N - 2 modes; for larger mode counts the error of the
+    full leave-one-out model is reported. Returns (mean, standard error) of the RMS point-to-point reconstruction error.
+    """
+    n_subjects = coordinates.shape[0]
+    n_jobs = n_jobs or os.cpu_count() or 1
+    chunks = [c for c in np.array_split(np.arange(n_subjects), n_jobs) if c.size]
+
+    # LAPACK releases the GIL, so the per-subject eigenproblems run in parallel threads
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        errors = np.vstack(list(pool.map(
+            lambda chunk: _leave_one_out_errors(coordinates, chunk, mode_counts, n_points), chunks)))
+
+    return errors.mean(axis=0), errors.std(axis=0, ddof=1) / np.sqrt(n_subjects - 1)
+
+
+def specificity(coordinates, eigenvalues, mode_counts, n_points, n_samples=1000, n_jobs=None, seed=0):
+    """
+    Specificity for each number of modes.
+
+    Draws n_samples shapes from the Gaussian model restricted to the first M modes and
+    returns (mean, standard error) of the RMS distance to the closest training shape.
+    """
+    train_sq = np.sum(coordinates ** 2, axis=1)
+    seeds = np.random.SeedSequence(seed).spawn(len(mode_counts))
+
+    def evaluate(args):
+        n_modes, seed_sequence = args
+        rng = np.random.default_rng(seed_sequence)
+        samples = rng.standard_normal((n_samples, n_modes)) * np.sqrt(eigenvalues[:n_modes])
+        sq_dist = (np.sum(samples ** 2, axis=1)[:, None] + train_sq[None, :]
+                   - 2.0 * samples @ coordinates[:, :n_modes].T)
+        nearest = np.sqrt(np.clip(sq_dist.min(axis=1), 0.0, None) / n_points)
+        return nearest.mean(), nearest.std(ddof=1) / np.sqrt(n_samples)
+
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count() or 1) as pool:
+        results = list(pool.map(evaluate, zip(mode_counts, seeds)))
+
+    return np.array([r[0] for r in results]), np.array([r[1] for r in results])
+
+
+def ssm_quality_metrics(shapes, max_modes=30, n_samples=1000, n_jobs=None, seed=0):
+    """
+    Compactness, generalization and specificity of a PCA model built from aligned shapes.
+
+    shapes: (n_subjects, 3 * n_points) matrix of aligned shapes in correspondence
+    Returns a DataFrame with one row per number of modes (1 .. max_modes).
+    """
+    n_points = shapes.shape[1] // 3
+    coordinates, eigenvalues = pca_coordinates(shapes)
+    mode_counts = list(range(1, min(max_modes, eigenvalues.size) + 1))
+
+    print(f"Evaluating SSM quality for 1-{mode_counts[-1]} modes ({shapes.shape[0]} subjects)...")
+    comp, comp_std = compactness(eigenvalues, shapes.shape[0], mode_counts)
+    gen, gen_std = generalization(coordinates, mode_counts, n_points, n_jobs=n_jobs)
+    spec, spec_std = specificity(coordinates, eigenvalues, mode_counts, n_points,
+                                 n_samples=n_samples, n_jobs=n_jobs, seed=seed)
+
+    return pd.DataFrame({
+        "n_modes": mode_counts,
+        "compactness": comp,
+        "compactness_std": comp_std,
+        "generalization": gen,
+        "generalization_std": gen_std,
+        "specificity": spec,
+        "specificity_std": spec_std,
+    })
+
+
+def plot_quality_metrics(report, image_output_path=None):
+    fig, axes = plt.subplots(1, 3, figsize=(15, 4.5))
+    columns = [("compactness", "Compactness"), ("generalization", "Generalization (RMS)"),
+               ("specificity", "Specificity (RMS)")]
+
+    for ax, (column, label) in zip(axes, columns):
+        ax.errorbar(report["n_modes"], report[column], yerr=report[f"{column}_std"],
+                    marker='o', color='black', capsize=2)
+        ax.axvline(x=8, color=viridis(0.4), linestyle='dotted', linewidth=3, label='Visualization Threshold')
+        ax.axvline(x=20, color=viridis(0.8), linestyle='dotted', linewidth=3, label='Analysis Threshold')
+        ax.set_xlabel('Number of modes')
+        ax.set_ylabel(label)
+        ax.grid(True)
+    axes[0].legend()
+    plt.tight_layout()
+
+    if image_output_path:
+        plt.savefig(image_output_path, dpi=300)
+        print(f"Saved quality metrics plot to: {image_output_path}")
+    else:
+        plt.show()
+
+
+def evaluate_ssm(input_dir, output_dir, image_output_path=None, max_modes=30, n_samples=1000, n_jobs=None, seed=0):
+    ensure_dir(output_dir)
+
+    mesh_files = find_mesh_files(input_dir)
+    print(f"Found {len(mesh_files)} mesh files.")
+
+    meshes = [load_vtk_polydata_mesh(f) for f in mesh_files]
+    shapes = aligned_shape_matrix(procrustes_align(meshes))
+
+    report = ssm_quality_metrics(shapes, max_modes=max_modes, n_samples=n_samples, n_jobs=n_jobs, seed=seed)
+    report_path = os.path.join(output_dir, "ssm_quality_metrics.csv")
+    report.to_csv(report_path, index=False)
+    print(report.to_string(index=False))
+    print(f"Saved quality metrics to: {report_path}")
+
+    plot_quality_metrics(report, image_output_path)
+    return report
+
+
+if __name__ == "__main__":
+    evaluate_ssm(
+        input_dir="/path/to/input",  # directory containing *.vtk meshes
+        output_dir="/path/to/output",  # directory to store the metrics table
+        image_output_path="/path/to/save/quality_metrics.png"  # optional
+    )